@@ -0,0 +1,131 @@
+from collections import namedtuple
+from traceback import format_exc
+from sys import stderr
+
+from correlation import load_engine, calculate_candidates, segmented_correlation, windowed_correlation
+from recording_format import is_binary_recording, read_header, open_recording
+from compressed_recording import is_compressed_recording, read_compressed_header, read_compressed_recording
+from signal_loader import load_text_recordings
+import telemetry
+
+MODES = ("standard", "segments", "segments_phat", "window")
+
+AnalysisResult = namedtuple("AnalysisResult", ["success", "reason_of_error", "error_location", "result_array", "candidates"])
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+def failure(reason_of_error, error_location=None):
+    return AnalysisResult(False, reason_of_error, error_location, None, ())
+
+
+def length_is_valid(length, length_of_arrays, mode):
+    if mode == "standard":
+        return length == length_of_arrays
+    return length >= length_of_arrays
+
+
+def scaled_progress(on_progress, start, stop):
+    if on_progress is None:
+        return None
+    return lambda fraction: on_progress(start + (stop - start) * fraction)
+
+
+def engine_name(engine, mode):
+    if mode == "window":
+        return windowed_correlation.__name__
+    if mode != "standard":
+        return segmented_correlation.__name__
+    return engine.__name__
+
+
+def correlate(arrays, distance, sound_speed, mode, engine, on_progress):
+    if mode == "standard":
+        return engine(arrays[0], arrays[1], sound_speed, distance, on_progress=scaled_progress(on_progress, 0.5, 0.95))
+    if mode == "window":
+        return windowed_correlation(arrays[0], arrays[1], sound_speed, distance, on_progress=scaled_progress(on_progress, 0.5, 0.95))
+    return segmented_correlation(arrays[0], arrays[1], sound_speed, distance, phat=mode == "segments_phat",
+                                 on_progress=scaled_progress(on_progress, 0.5, 0.95))
+
+
+def load_arrays(file_names, length_of_arrays, mode, on_progress=None):
+    try:
+        if all(is_binary_recording(name) for name in file_names):
+            headers = [read_header(name) for name in file_names]
+            if not all(length_is_valid(header.count, length_of_arrays, mode) for header in headers):
+                return None, failure("wrong_length")
+            with telemetry.stage("file_read", samples=sum(header.count for header in headers)):
+                arrays = [open_recording(name, header) for name, header in zip(file_names, headers)]
+        elif all(is_compressed_recording(name) for name in file_names):
+            headers = [read_compressed_header(name) for name in file_names]
+            if not all(length_is_valid(header.count, length_of_arrays, mode) for header in headers):
+                return None, failure("wrong_length")
+            arrays = []
+            for index, name in enumerate(file_names):
+                with telemetry.stage("decompress", path=name, samples=headers[index].count):
+                    arrays.append(read_compressed_recording(name, scaled_progress(on_progress, index / len(file_names) / 2, (index + 1) / len(file_names) / 2)))
+        else:
+            arrays = []
+            for name, (array, bad_line) in zip(file_names, load_text_recordings(file_names, scaled_progress(on_progress, 0, 0.5))):
+                if bad_line is not None:
+                    return None, failure("value", (name, bad_line))
+                arrays.append(array)
+    except (OSError, ValueError):
+        return None, failure("value")
+
+    if not all(length_is_valid(len(array), length_of_arrays, mode) for array in arrays):
+        return None, failure("wrong_length")
+    return arrays, None
+
+
+def analyse_recordings(file_names, distance, sound_speed, mode="standard", engine=None, on_progress=None, cache=None):
+    report = on_progress or (lambda fraction: None)
+    length_of_arrays = round(distance / sound_speed * 33600)
+    engine = engine or load_engine()
+
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.key(file_names, distance, sound_speed, mode, engine_name(engine, mode))
+        except OSError:
+            return failure("value")
+
+        cached = cache.get(cache_key)
+        if cached is not None:
+            result_array, candidates = cached
+            result_array.flags.writeable = False
+            report(1)
+            return AnalysisResult(True, None, None, result_array, candidates)
+
+    arrays, error = load_arrays(file_names, length_of_arrays, mode, on_progress)
+    if error is not None:
+        return error
+    report(0.5)
+
+    try:
+        with telemetry.stage("correlation", mode=mode, engine=engine_name(engine, mode), samples=len(arrays[0])):
+            result_array = correlate(arrays, distance, sound_speed, mode, engine, on_progress)
+        report(0.95)
+
+        with telemetry.stage("peak_detection", samples=len(result_array)):
+            candidates = tuple((peak, tuple(result_distances)) for peak, result_distances in calculate_candidates(result_array, distance, sound_speed))
+    except AnalysisCancelled:
+        raise
+    except Exception:
+        print(format_exc(10), file=stderr)
+        return failure("OS")
+
+    # Callers take the best candidate for granted, so a result without one
+    # is a failure: no delays at all means the sensors are too close for
+    # the recording.
+    if not candidates:
+        return failure("wrong_length" if not len(result_array) else "OS")
+
+    if cache_key is not None:
+        cache.put(cache_key, result_array, candidates)
+
+    result_array.flags.writeable = False
+    report(1)
+    return AnalysisResult(True, None, None, result_array, candidates)
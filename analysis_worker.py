@@ -0,0 +1,38 @@
+from threading import Event
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+from analysis import AnalysisCancelled, analyse_recordings, failure
+
+class AnalysisSignals(QObject):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+
+class AnalysisWorker(QRunnable):
+    def __init__(self, file_names, distance, sound_speed, mode, engine, cache=None):
+        super().__init__()
+        self.file_names = file_names
+        self.distance = distance
+        self.sound_speed = sound_speed
+        self.mode = mode
+        self.engine = engine
+        self.cache = cache
+
+        self.signals = AnalysisSignals()
+        self.cancelled = Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def report_progress(self, fraction):
+        if self.cancelled.is_set():
+            raise AnalysisCancelled()
+        self.signals.progress.emit(round(fraction * 100))
+
+    def run(self):
+        try:
+            result = analyse_recordings(self.file_names, self.distance, self.sound_speed, self.mode, self.engine, self.report_progress, self.cache)
+        except AnalysisCancelled:
+            result = failure("cancelled")
+
+        self.signals.finished.emit(result)
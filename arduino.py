@@ -1,20 +1,366 @@
+from contextlib import ExitStack
+from queue import Queue
+import struct
+from threading import Thread, Event
+import time
+import zlib
+
+import numpy
 import serial
 
 import serial.serialutil
 
-def write_signals_in_file(com_port, path, file_name, distance, sound_speed):
+from correlation import SAMPLE_RATE
+from recording_writer import RecordingWriter
+import telemetry
+
+FRAMINGS = ("text", "binary")
+# Binary framing: marker, frame number, sample count, little-endian int16
+# samples and the CRC-32 of the samples.
+FRAME_MARKER = b"\xa5\x5a"
+FRAME_HEADER = struct.Struct("<2sHH")
+FRAME_CHECKSUM = struct.Struct("<I")
+MAX_FRAME_SAMPLES = 1024
+# Share of corrupted readings after which a recording is given up.
+MAX_REJECTED = 0.01
+# Share of a channel that may be made up to keep the pair aligned.
+MAX_PADDING = 0.01
+
+def port_name(com_port):
+    com_port = str(com_port)
+    if com_port.isdigit():
+        return f"com{com_port}"
+    return com_port
+
+def parse_text_chunk(chunk, last_sample=0):
+    tokens = chunk.split()
+    try:
+        values = numpy.array(tokens, dtype=bytes).astype(numpy.int64)
+        valid = (values >= -32768) & (values <= 32767)
+    except ValueError:
+        values = numpy.zeros(len(tokens), dtype=numpy.int64)
+        valid = numpy.zeros(len(tokens), dtype=bool)
+        for index, token in enumerate(tokens):
+            try:
+                value = int(token)
+            except ValueError:
+                continue
+            if -32768 <= value <= 32767:
+                values[index] = value
+                valid[index] = True
+
+    rejected = len(tokens) - int(numpy.count_nonzero(valid))
+    if rejected:
+        # A corrupted reading still took its place in time, so it holds the
+        # last good value instead of being dropped and shifting the rest.
+        last_valid = numpy.maximum.accumulate(numpy.where(valid, numpy.arange(len(values)), -1))
+        values = numpy.where(last_valid >= 0, values[numpy.maximum(last_valid, 0)], last_sample)
+    return values.astype(numpy.int16), rejected
+
+def encode_binary_frame(samples, number):
+    payload = numpy.asarray(samples).astype("<i2").tobytes()
+    return FRAME_HEADER.pack(FRAME_MARKER, number % 65536, len(samples)) + payload + FRAME_CHECKSUM.pack(zlib.crc32(payload))
+
+def parse_binary_frames(data):
+    # Returns every whole frame as (number, samples), the bytes consumed and
+    # the bytes thrown away. A frame that does not check out is skipped by
+    # looking for the next marker, so a lost byte costs one frame only.
+    frames = []
+    position = rejected = 0
+    while True:
+        start = data.find(FRAME_MARKER, position)
+        if start < 0:
+            keep = 1 if data.endswith(FRAME_MARKER[:1]) else 0
+            rejected += len(data) - keep - position
+            position = len(data) - keep
+            break
+        rejected += start - position
+        position = start
+        if start + FRAME_HEADER.size > len(data):
+            break
+
+        number, count = FRAME_HEADER.unpack_from(data, start)[1:]
+        stop = start + FRAME_HEADER.size + 2 * count + FRAME_CHECKSUM.size
+        if not 0 < count <= MAX_FRAME_SAMPLES:
+            rejected += 1
+            position = start + 1
+            continue
+        if stop > len(data):
+            break
+
+        payload = data[start + FRAME_HEADER.size:stop - FRAME_CHECKSUM.size]
+        if FRAME_CHECKSUM.unpack_from(data, stop - FRAME_CHECKSUM.size)[0] != zlib.crc32(payload):
+            rejected += 1
+            position = start + 1
+            continue
+        frames.append((number, numpy.frombuffer(payload, dtype="<i2").astype(numpy.int16)))
+        position = stop
+
+    return frames, position, rejected
+
+class SampleParser:
+    def __init__(self, framing="text", chunk_size=4096):
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing '{framing}', expected one of {', '.join(FRAMINGS)}")
+        self.framing = framing
+        self.chunk_size = chunk_size
+        self.last_sample = 0
+        self.next_frame = None
+        self.parsed = 0
+        self.rejected = 0
+
+    def parse(self, data):
+        # Returns the samples found in `data` and how many of its bytes were
+        # used; the rest is waiting for more data.
+        if self.framing == "binary":
+            frames, consumed, rejected_bytes = parse_binary_frames(data)
+            samples, rejected = self.fill_lost_frames(frames)
+            if not frames:
+                # Without any good frame the lost samples cannot be counted,
+                # so the thrown-away bytes stand in for them.
+                rejected = -(-rejected_bytes // 2)
+                self.parsed += rejected
+        else:
+            consumed = data.rfind(b"\n") + 1
+            if consumed == 0:
+                # A stream without line breaks is noise, not a long number.
+                if len(data) < self.chunk_size:
+                    return numpy.zeros(0, dtype=numpy.int16), 0
+                samples, consumed, rejected = numpy.zeros(0, dtype=numpy.int16), len(data), 1
+                self.parsed += rejected
+            else:
+                # Rejected lines are already among the samples, held at
+                # the last good value.
+                samples, rejected = parse_text_chunk(data[:consumed], self.last_sample)
+
+        self.parsed += len(samples)
+        self.rejected += rejected
+        if len(samples):
+            self.last_sample = samples[-1]
+
+        # The line or frame cut off when the port was opened is not the
+        # sensor's fault.
+        if self.rejected > MAX_REJECTED * self.parsed + MAX_FRAME_SAMPLES:
+            raise serial.serialutil.SerialException("Sensor sends corrupted data")
+        return samples, consumed
+
+    def fill_lost_frames(self, frames):
+        # Frames lost on the link are found by their numbers and held at the
+        # last value, so the samples after them keep their place in time.
+        blocks = []
+        rejected = 0
+        last_sample = self.last_sample
+        for number, samples in frames:
+            if self.next_frame is not None:
+                lost = (number - self.next_frame) % 65536
+                if lost:
+                    blocks.append(numpy.full(lost * len(samples), last_sample, dtype=numpy.int16))
+                    rejected += lost * len(samples)
+            blocks.append(samples)
+            last_sample = samples[-1]
+            self.next_frame = (number + 1) % 65536
+
+        samples = numpy.concatenate(blocks) if blocks else numpy.zeros(0, dtype=numpy.int16)
+        return samples, rejected
+
+def read_sample_blocks(signal, length, framing="text", chunk_size=4096, timeout=5, stop=None):
+    buffer = bytearray(chunk_size * 2)
+    view = memoryview(buffer)
+    start = end = 0
+    received = 0
+    last_data_time = time.monotonic()
+    block_started = time.perf_counter()
+    parser = SampleParser(framing, chunk_size)
+
+    while received < length and not (stop and stop.is_set()):
+        if end == len(buffer):
+            buffer[:end - start] = buffer[start:end]
+            start, end = 0, end - start
+
+        count = signal.readinto(view[end:end + max(1, min(signal.in_waiting, len(buffer) - end))])
+        if not count:
+            if time.monotonic() - last_data_time > timeout:
+                raise serial.serialutil.SerialTimeoutException("Sensor stopped sending data")
+            continue
+        last_data_time = time.monotonic()
+        end += count
+
+        if end - start < chunk_size and received + (end - start) // 2 < length:
+            continue
+
+        samples, consumed = parser.parse(bytes(view[start:end]))
+        block_bytes = consumed
+        start += consumed
+        if not len(samples):
+            continue
+
+        samples = samples[:length - received]
+        received += len(samples)
+        telemetry.record("serial_read", block_started, port=signal.port, framing=framing, bytes=block_bytes, samples=len(samples),
+                         rejected=parser.rejected)
+        yield samples
+        block_started = time.perf_counter()
+
+def write_signals_in_file(com_port, path, file_name, distance, sound_speed, file_format="txt", baud_rate=9600, framing="text", write_block=65536, fsync="close",
+                          sample_rate=SAMPLE_RATE, stop=None):
     success = 1
-    length = round(distance / sound_speed * 9600)
+    length = round(distance / sound_speed * 33600)
+    signal = None
     try:
-        signal = serial.Serial(f"com{com_port}", 9600)
-        with open(f"{path}/{file_name}.txt", "w") as file:
-            k = 0
-
-            while k < length:
-                sensor_signal = int(signal.readline())
-                file.write(sensor_signal + "\n")
-                k += 1
-    except serial.serialutil.SerialException:
+        signal = serial.Serial(port_name(com_port), baud_rate, timeout=0.1)
+        with RecordingWriter(f"{path}/{file_name}.{file_format}", file_format, sample_rate, length, distance, sound_speed, write_block, fsync) as writer:
+            for samples in read_sample_blocks(signal, length, framing, stop=stop):
+                writer.write(samples)
+        if stop is not None and stop.is_set():
+            success = 0
+    except (OSError, ValueError, serial.serialutil.SerialException):
+        success = 0
+    finally:
+        if signal is not None:
+            signal.close()
+    return success
+
+
+class ChannelAligner:
+    # Each channel's real rate is measured from its own arrival times: a link
+    # slower than the ADC delivers fewer samples per second than the nominal
+    # rate, and those were never recorded, not lost. Only what one channel is
+    # missing next to the faster one is padded.
+    def __init__(self, sample_rate=SAMPLE_RATE, max_skew=480):
+        self.sample_rate = sample_rate
+        self.max_skew = max_skew
+
+        self.first_arrivals = [None, None]
+        self.received = [0, 0]
+        self.rates = [None, None]
+        self.common_start = None
+        self.early_blocks = [[], []]
+        self.to_drop = [0, 0]
+        self.emitted = [0, 0]
+        self.padded = [0, 0]
+        self.last_samples = [0, 0]
+        self.aligned = [[], []]
+
+    def measure(self, channel, timestamp, samples):
+        self.received[channel] += len(samples)
+        if self.first_arrivals[channel] is None:
+            self.first_arrivals[channel] = (timestamp, len(samples))
+            return
+
+        first_timestamp, first_count = self.first_arrivals[channel]
+        if timestamp > first_timestamp:
+            rate = (self.received[channel] - first_count) / (timestamp - first_timestamp)
+            self.rates[channel] = min(rate, self.sample_rate)
+
+    def add_block(self, channel, timestamp, samples):
+        self.measure(channel, timestamp, samples)
+
+        if self.common_start is None:
+            self.early_blocks[channel].append((timestamp, samples))
+            if None in self.rates:
+                return
+
+            # Both streams are running: the one that started first loses the
+            # samples recorded before the other one came up.
+            start_times = [first_timestamp - first_count / rate for (first_timestamp, first_count), rate in zip(self.first_arrivals, self.rates)]
+            self.common_start = max(start_times)
+            for i in range(2):
+                self.to_drop[i] = round((self.common_start - start_times[i]) * self.rates[i])
+                for early_timestamp, early_samples in self.early_blocks[i]:
+                    self.align(i, early_timestamp, early_samples)
+            self.early_blocks = [[], []]
+            return
+
+        self.align(channel, timestamp, samples)
+
+    def padding(self):
+        return max(padded / max(emitted, 1) for padded, emitted in zip(self.padded, self.emitted))
+
+    def align(self, channel, timestamp, samples):
+        if self.to_drop[channel]:
+            dropped = min(self.to_drop[channel], len(samples))
+            self.to_drop[channel] -= dropped
+            samples = samples[dropped:]
+            if self.to_drop[channel]:
+                return
+
+        expected = round((timestamp - self.common_start) * max(self.rates))
+        skew = expected - (self.emitted[channel] + len(samples))
+        if skew > self.max_skew:
+            # Samples were lost on the link: hold the last value over the gap.
+            samples = numpy.concatenate((numpy.full(skew, self.last_samples[channel], dtype=samples.dtype), samples))
+            self.padded[channel] += skew
+        elif skew < -self.max_skew:
+            samples = samples[min(-skew, len(samples)):]
+
+        if len(samples):
+            self.last_samples[channel] = samples[-1]
+            self.emitted[channel] += len(samples)
+            self.aligned[channel].append(samples)
+
+    def take(self):
+        channels = [numpy.concatenate(blocks) if blocks else numpy.zeros(0, dtype=numpy.int16) for blocks in self.aligned]
+        length = min(len(channels[0]), len(channels[1]))
+        self.aligned = [[channel[length:]] if len(channel) > length else [] for channel in channels]
+        return channels[0][:length], channels[1][:length]
+
+def read_channel(signal, length, framing, blocks, channel, stop):
+    try:
+        for samples in read_sample_blocks(signal, length, framing, stop=stop):
+            blocks.put((channel, time.monotonic(), samples))
+        blocks.put((channel, None, None))
+    except Exception as error:
+        blocks.put((channel, None, error))
+
+def write_dual_signals_in_file(com_ports, path, file_name, distance, sound_speed, file_format="txt", baud_rate=9600, framing="text", max_skew=480, correlator=None, fsync="close",
+                               sample_rate=SAMPLE_RATE):
+    success = 1
+    length = round(distance / sound_speed * 33600)
+    signals = []
+    stop = Event()
+    try:
+        for com_port in com_ports:
+            signals.append(serial.Serial(port_name(com_port), baud_rate, timeout=0.1))
+        file_names = [f"{path}/{file_name}.{file_format}", f"{path}/{file_name}_1.{file_format}"]
+        with ExitStack() as files:
+            writers = [files.enter_context(RecordingWriter(name, file_format, sample_rate, length, distance, sound_speed, fsync=fsync))
+                       for name in file_names]
+
+            # Each reader may need to give up some leading samples for alignment.
+            blocks = Queue()
+            readers = [Thread(target=read_channel, args=(signals[i], length + sample_rate, framing, blocks, i, stop), daemon=True) for i in range(2)]
+            for reader in readers:
+                reader.start()
+
+            aligner = ChannelAligner(sample_rate, max_skew)
+            written = 0
+            running = 2
+            while written < length and running:
+                channel, timestamp, samples = blocks.get()
+                if timestamp is None:
+                    if samples is not None:
+                        raise samples
+                    running -= 1
+                    continue
+
+                aligner.add_block(channel, timestamp, samples)
+                block_1, block_2 = aligner.take()
+                block_1, block_2 = block_1[:length - written], block_2[:length - written]
+                if len(block_1):
+                    writers[0].write(block_1)
+                    writers[1].write(block_2)
+                    if correlator is not None:
+                        correlator.add_samples(block_1, block_2)
+                    written += len(block_1)
+
+            if written < length or aligner.padding() > MAX_PADDING:
+                success = 0
+            if correlator is not None:
+                correlator.flush()
+    except (OSError, ValueError, serial.serialutil.SerialException):
         success = 0
     finally:
-        return success
\ No newline at end of file
+        stop.set()
+        for signal in signals:
+            signal.close()
+    return success
@@ -1,41 +1,90 @@
-from random import randint
-
-def make_arrays(distance, sound_speed, shift=500):
-    array1 = []
-    array2 = []
-    h = round(distance / sound_speed * 9600)
-
-    for i in range(round(h * 3.5)):
-        array1.append(0)
-        array2.append(0)
-
-    for i in range(round(h * 3.5)):
-        j = i
-        while j >= h:
-            j = j - h
-            array1[i] = array1[j]
+from contextlib import ExitStack
+
+import numpy
+
+from recording_writer import RecordingWriter
+
+SAMPLE_RATE = 9600
+LEAK_MODELS = ("uniform", "gaussian")
+LEAK_BLOCK_SIZE = 65536
+
+def recording_length(distance, sound_speed):
+    return round(distance / sound_speed * 33600)
+
+def make_leak_block(seed, index, leak):
+    # Every block is drawn from its own counter-based stream, so any part of
+    # the leak signal can be regenerated without keeping the earlier ones.
+    rng = numpy.random.default_rng([seed, 0, index])
+    if leak == "gaussian":
+        return numpy.clip(rng.normal(512, 150, LEAK_BLOCK_SIZE), 1, 1024)
+    return rng.integers(1, 1025, LEAK_BLOCK_SIZE).astype(numpy.float64)
+
+def leak_signal(seed, start, stop, leak):
+    first_block, last_block = start // LEAK_BLOCK_SIZE, (stop - 1) // LEAK_BLOCK_SIZE
+    blocks = [make_leak_block(seed, index, leak) for index in range(first_block, last_block + 1)]
+    offset = first_block * LEAK_BLOCK_SIZE
+    return numpy.concatenate(blocks)[start - offset:stop - offset]
+
+def generate_blocks(length, shift=500, seed=None, noise=0.0, attenuation=1.0, leak="uniform", block_size=65536):
+    if leak not in LEAK_MODELS:
+        raise ValueError(f"Unknown leak model '{leak}', expected one of {', '.join(LEAK_MODELS)}")
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+
+    shift %= max(length, 1)
+    noise_rng = numpy.random.default_rng([seed, 1])
+
+    for start in range(0, length, block_size):
+        stop = min(start + block_size, length)
+        block_1 = leak_signal(seed, start, stop, leak)
+
+        # The second sensor hears the same leak `shift` samples earlier,
+        # wrapping around the end of the recording.
+        shifted_start, shifted_stop = start + shift, stop + shift
+        if shifted_stop <= length:
+            block_2 = leak_signal(seed, shifted_start, shifted_stop, leak)
+        elif shifted_start >= length:
+            block_2 = leak_signal(seed, shifted_start - length, shifted_stop - length, leak)
         else:
-            array1[i] = randint(1, 1024)
+            block_2 = numpy.concatenate((leak_signal(seed, shifted_start, length, leak),
+                                         leak_signal(seed, 0, shifted_stop - length, leak)))
+        block_2 = block_2 * attenuation
 
-    for i in range(round(h * 3.5)):
-        j = i + shift
-        if j >= len(array2):
-            j = j - len(array2)
+        if noise:
+            block_1 = block_1 + noise_rng.normal(0, noise, len(block_1))
+            block_2 = block_2 + noise_rng.normal(0, noise, len(block_2))
 
-        array2[i] = array1[j]
-    
-    return (array1, array2)
+        yield (numpy.clip(numpy.rint(block_1), 0, 1024).astype(numpy.int16),
+               numpy.clip(numpy.rint(block_2), 0, 1024).astype(numpy.int16))
 
-def write_signals_in_file(distance, sound_speed, first_dir_path, second_dir_path, first_file_name, second_file_name):
-    array_1, array_2 = make_arrays(distance, sound_speed)
+def make_arrays(distance, sound_speed, shift=500, **model):
+    blocks = list(generate_blocks(recording_length(distance, sound_speed), shift, **model))
+    if not blocks:
+        return (numpy.zeros(0, dtype=numpy.int16), numpy.zeros(0, dtype=numpy.int16))
 
-    with open(first_dir_path + "/" + first_file_name, "w") as first_file:
-        for i in array_1:
-            first_file.write(str(i // 100) + "\n")
+    return (numpy.concatenate([block_1 for block_1, block_2 in blocks]),
+            numpy.concatenate([block_2 for block_1, block_2 in blocks]))
 
-    with open(second_dir_path + "/" + second_file_name, "w") as second_file:
-        for i in array_2:
-            second_file.write(str(i // 100) + "\n")
+def write_signals_in_file(distance, sound_speed, first_dir_path, second_dir_path, first_file_name, second_file_name, file_format="txt", correlator=None, length=None, fsync="never", stop=None, **model):
+    if length is None:
+        length = recording_length(distance, sound_speed)
 
-    return 1
+    with ExitStack() as files:
+        first_writer = files.enter_context(RecordingWriter(first_dir_path + "/" + first_file_name, file_format, SAMPLE_RATE, length, distance, sound_speed, fsync=fsync))
+        second_writer = files.enter_context(RecordingWriter(second_dir_path + "/" + second_file_name, file_format, SAMPLE_RATE, length, distance, sound_speed, fsync=fsync))
+        for block_1, block_2 in generate_blocks(length, **model):
+            if stop is not None and stop.is_set():
+                return 0
+
+            block_1 //= 100
+            block_2 //= 100
+            first_writer.write(block_1)
+            second_writer.write(block_2)
 
+            if correlator is not None:
+                correlator.add_samples(block_1, block_2)
+
+    if correlator is not None:
+        correlator.flush()
+
+    return 1
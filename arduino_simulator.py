@@ -0,0 +1,172 @@
+import argparse
+import os
+import pty
+import tempfile
+import time
+import tty
+from threading import Thread, Event
+
+import numpy
+
+from arduino_imitation import generate_blocks, recording_length
+import arduino
+from recording_format import HEADER_SIZE
+
+
+class SerialSimulator:
+    def __init__(self, distance, sound_speed, channel=0, baud_rate=9600, sample_rate=9600, framing="text",
+                 jitter=0.0, drop_rate=0.0, seed=0, **model):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.length = recording_length(distance, sound_speed)
+        self.channel = channel
+        self.baud_rate = baud_rate
+        self.sample_rate = sample_rate
+        self.framing = framing
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.seed = seed
+        self.model = model
+
+        self.rng = numpy.random.default_rng([seed, 2, channel])
+        self.stop_event = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+        self.samples_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+
+    def samples(self):
+        # The Arduino never stops sending, so the recording is replayed in a
+        # loop. It is generated in large blocks and sliced into 10 ms sends:
+        # every generated block draws a whole leak block, so small ones would
+        # load the thread that paces the output.
+        send_size = max(1, self.sample_rate // 100)
+        while True:
+            for blocks in generate_blocks(self.length, seed=self.seed, **self.model):
+                samples = blocks[self.channel]
+                for start in range(0, len(samples), send_size):
+                    yield samples[start:start + send_size]
+
+    def encode(self, samples):
+        if self.framing == "binary":
+            data = arduino.encode_binary_frame(samples, self.frames_sent)
+        else:
+            data = ("\r\n".join(map(str, samples.tolist())) + "\r\n").encode()
+
+        if self.drop_rate:
+            kept = self.rng.random(len(data)) >= self.drop_rate
+            self.bytes_dropped += len(data) - int(kept.sum())
+            data = numpy.frombuffer(data, dtype=numpy.uint8)[kept].tobytes()
+        return data
+
+    def run(self):
+        deadline = time.monotonic()
+        for samples in self.samples():
+            if self.stop_event.is_set():
+                break
+
+            data = self.encode(samples)
+            # 8N1 framing spends 10 bits on the wire per byte; a link slower
+            # than the ADC holds the sender back just like the real board.
+            deadline += max(len(samples) / self.sample_rate, len(data) * 10 / self.baud_rate)
+            delay = deadline - time.monotonic()
+            if self.jitter:
+                delay += self.rng.normal(0, self.jitter)
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                os.write(self.master, data)
+            except OSError:
+                break
+            self.samples_sent += len(samples)
+            self.frames_sent += 1
+            self.bytes_sent += len(data)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1)
+        for descriptor in (self.master, self.slave):
+            try:
+                os.close(descriptor)
+            except OSError:
+                pass
+
+
+def measure_acquisition(distance, sound_speed, baud_rate=9600, sample_rate=9600, framing="text", jitter=0.0, drop_rate=0.0, seed=0):
+    simulator = SerialSimulator(distance, sound_speed, baud_rate=baud_rate, sample_rate=sample_rate, framing=framing,
+                                jitter=jitter, drop_rate=drop_rate, seed=seed).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.monotonic()
+            success = arduino.write_signals_in_file(simulator.port, directory, "recording", distance, sound_speed,
+                                                    file_format="bin", baud_rate=baud_rate, framing=framing)
+            elapsed = time.monotonic() - start
+
+            received = numpy.fromfile(f"{directory}/recording.bin", dtype="<i2", offset=HEADER_SIZE) if success else numpy.zeros(0)
+    finally:
+        stop_sent = simulator.samples_sent
+        simulator.stop()
+
+    expected = next(generate_blocks(simulator.length, seed=seed, block_size=simulator.length))[0] if simulator.length else numpy.zeros(0)
+    matched = int(numpy.sum(received[:len(expected)] == expected[:len(received)]))
+
+    return {
+        "success": success,
+        "elapsed": elapsed,
+        "samples_expected": simulator.length,
+        "samples_received": len(received),
+        "samples_matched": matched,
+        "samples_per_second": len(received) / elapsed if elapsed else 0,
+        "samples_sent": stop_sent,
+        "bytes_sent": simulator.bytes_sent,
+        "bytes_dropped": simulator.bytes_dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pseudo-terminal stand-in for the sensor Arduino")
+    parser.add_argument("--distance", type=float, default=500)
+    parser.add_argument("--sound-speed", type=float, default=1430)
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--sample-rate", type=int, default=9600)
+    parser.add_argument("--framing", choices=["text", "binary"], default="text")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of send timing, seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of losing each byte")
+    parser.add_argument("--channels", type=int, choices=[1, 2], default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--measure", action="store_true", help="record one file through arduino.py and report throughput and loss")
+    args = parser.parse_args()
+
+    if args.measure:
+        result = measure_acquisition(args.distance, args.sound_speed, args.baud, args.sample_rate, args.framing,
+                                     args.jitter, args.drop_rate, args.seed)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        return
+
+    simulators = [SerialSimulator(args.distance, args.sound_speed, channel, args.baud, args.sample_rate, args.framing,
+                                  args.jitter, args.drop_rate, args.seed).start() for channel in range(args.channels)]
+    for channel, simulator in enumerate(simulators):
+        print(f"Sensor {channel + 1}: {simulator.port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
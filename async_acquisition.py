@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+from contextlib import ExitStack
+import datetime
+import time
+
+import serial
+import serial.serialutil
+
+from arduino import MAX_PADDING, ChannelAligner, SampleParser, port_name
+from correlation import SAMPLE_RATE
+from recording_scheduler import next_start
+from recording_writer import RecordingWriter
+import telemetry
+
+# Every port is watched by the event loop's reader callbacks, so one thread
+# can record from any number of sensors. Windows event loops cannot watch
+# serial handles, so there the threaded functions in arduino.py remain the
+# way to record.
+
+
+class PortReader:
+    def __init__(self, signal, length, framing, on_samples, chunk_size=4096):
+        self.loop = asyncio.get_running_loop()
+        self.signal = signal
+        self.length = length
+        self.framing = framing
+        self.on_samples = on_samples
+        self.chunk_size = chunk_size
+        self.parser = SampleParser(framing, chunk_size)
+
+        self.buffer = bytearray()
+        self.received = 0
+        self.done = self.loop.create_future()
+        self.last_data_time = self.loop.time()
+        self.block_started = time.perf_counter()
+
+    def start(self):
+        self.loop.add_reader(self.signal.fileno(), self.on_readable)
+
+    def stop(self):
+        self.loop.remove_reader(self.signal.fileno())
+
+    def finish(self, error=None):
+        self.stop()
+        if self.done.done():
+            return
+        if error is None:
+            self.done.set_result(self.received)
+        else:
+            self.done.set_exception(error)
+
+    def parse(self):
+        samples, consumed = self.parser.parse(bytes(self.buffer))
+        del self.buffer[:consumed]
+        return samples[:self.length - self.received], consumed
+
+    def on_readable(self):
+        try:
+            self.buffer += self.signal.read(max(1, self.signal.in_waiting))
+        except serial.serialutil.SerialException as error:
+            self.finish(error)
+            return
+        self.last_data_time = self.loop.time()
+
+        # Parsing a few bytes at a time would cost more than the data is
+        # worth; small reads are gathered until a chunk or the end is near.
+        if len(self.buffer) < self.chunk_size and self.received + len(self.buffer) // 2 < self.length:
+            return
+
+        try:
+            samples, block_bytes = self.parse()
+        except serial.serialutil.SerialException as error:
+            self.finish(error)
+            return
+        if not len(samples):
+            return
+
+        self.received += len(samples)
+        telemetry.record("serial_read", self.block_started, port=self.signal.port, framing=self.framing, bytes=block_bytes, samples=len(samples),
+                         rejected=self.parser.rejected)
+        self.block_started = time.perf_counter()
+
+        try:
+            self.on_samples(samples)
+        except Exception as error:
+            self.finish(error)
+            return
+
+        if self.received >= self.length:
+            self.finish()
+
+
+async def wait_for_start(start_at):
+    if start_at is None:
+        return
+    delay = (start_at - datetime.datetime.now()).total_seconds()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def watch(readers, finished, timeout):
+    loop = asyncio.get_running_loop()
+    while not finished.done():
+        await asyncio.wait([finished], timeout=timeout)
+        for reader in readers:
+            if not reader.done.done() and loop.time() - reader.last_data_time > timeout:
+                raise serial.serialutil.SerialTimeoutException("Sensor stopped sending data")
+    return finished.result()
+
+
+def open_port(com_port, baud_rate):
+    return serial.Serial(port_name(com_port), baud_rate, timeout=0)
+
+
+async def record_port(com_port, path, file_name, distance, sound_speed, file_format="txt", baud_rate=9600, framing="text",
+                      start_at=None, timeout=5, fsync="close", sample_rate=SAMPLE_RATE):
+    await wait_for_start(start_at)
+
+    length = round(distance / sound_speed * 33600)
+    signal = None
+    reader = None
+    try:
+        signal = open_port(com_port, baud_rate)
+        with RecordingWriter(f"{path}/{file_name}.{file_format}", file_format, sample_rate, length, distance, sound_speed, fsync=fsync) as writer:
+            reader = PortReader(signal, length, framing, writer.write)
+            reader.start()
+            await watch([reader], reader.done, timeout)
+        return 1
+    except (OSError, ValueError, serial.serialutil.SerialException):
+        return 0
+    finally:
+        if reader is not None:
+            reader.stop()
+        if signal is not None:
+            signal.close()
+
+
+async def record_pair(com_ports, path, file_name, distance, sound_speed, file_format="txt", baud_rate=9600, framing="text",
+                      start_at=None, timeout=5, max_skew=480, correlator=None, fsync="close", sample_rate=SAMPLE_RATE):
+    await wait_for_start(start_at)
+
+    loop = asyncio.get_running_loop()
+    length = round(distance / sound_speed * 33600)
+    finished = loop.create_future()
+    aligner = ChannelAligner(sample_rate, max_skew)
+    written = 0
+    signals = []
+    readers = []
+
+    def on_samples(channel, samples, writers):
+        nonlocal written
+        aligner.add_block(channel, loop.time(), samples)
+        block_1, block_2 = aligner.take()
+        block_1, block_2 = block_1[:length - written], block_2[:length - written]
+        if len(block_1):
+            writers[0].write(block_1)
+            writers[1].write(block_2)
+            if correlator is not None:
+                correlator.add_samples(block_1, block_2)
+            written += len(block_1)
+
+        if written >= length and not finished.done():
+            finished.set_result(written)
+
+    def on_reader_done(done):
+        if finished.done():
+            return
+        if done.exception() is not None:
+            finished.set_exception(done.exception())
+        elif all(reader.done.done() for reader in readers):
+            finished.set_result(written)
+
+    try:
+        for com_port in com_ports:
+            signals.append(open_port(com_port, baud_rate))
+        file_names = [f"{path}/{file_name}.{file_format}", f"{path}/{file_name}_1.{file_format}"]
+        with ExitStack() as files:
+            writers = [files.enter_context(RecordingWriter(name, file_format, sample_rate, length, distance, sound_speed, fsync=fsync))
+                       for name in file_names]
+
+            # Each reader may need to give up some leading samples for alignment.
+            readers = [PortReader(signal, length + sample_rate, framing, lambda samples, channel=channel: on_samples(channel, samples, writers))
+                       for channel, signal in enumerate(signals)]
+            for reader in readers:
+                reader.done.add_done_callback(on_reader_done)
+                reader.start()
+
+            await watch(readers, finished, timeout)
+
+        if correlator is not None:
+            correlator.flush()
+        return int(written >= length and aligner.padding() <= MAX_PADDING)
+    except (OSError, ValueError, serial.serialutil.SerialException):
+        return 0
+    finally:
+        for reader in readers:
+            reader.stop()
+        for signal in signals:
+            signal.close()
+
+
+async def record_all(recordings):
+    tasks = [asyncio.ensure_future(recording) for recording in recordings]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # A recording that fails in an unexpected way must not leave the
+        # others reading ports nobody is waiting for.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record several sensors from one thread")
+    parser.add_argument("ports", nargs="+", help="COM port numbers or device paths")
+    parser.add_argument("--pairs", action="store_true", help="record the ports two by two as sensor pairs")
+    parser.add_argument("--distance", type=float, required=True)
+    parser.add_argument("--sound-speed", type=float, required=True)
+    parser.add_argument("--directory", default=".")
+    parser.add_argument("--name", default="recording")
+    parser.add_argument("--format", choices=["txt", "bin", "lfz"], default="txt", dest="file_format")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--framing", choices=["text", "binary"], default="text")
+    parser.add_argument("--at", help="start time, HH:MM")
+    args = parser.parse_args()
+
+    start_at = None
+    if args.at:
+        hours, minutes = map(int, args.at.split(":"))
+        start_at = next_start(hours, minutes)
+
+    options = dict(file_format=args.file_format, baud_rate=args.baud, framing=args.framing, start_at=start_at)
+    if args.pairs:
+        if len(args.ports) % 2:
+            parser.error("--pairs needs an even number of ports")
+        groups = [args.ports[i:i + 2] for i in range(0, len(args.ports), 2)]
+        recordings = [record_pair(group, args.directory, f"{args.name}_{number + 1}", args.distance, args.sound_speed, **options)
+                      for number, group in enumerate(groups)]
+    else:
+        groups = [[port] for port in args.ports]
+        recordings = [record_port(port, args.directory, f"{args.name}_{number + 1}", args.distance, args.sound_speed, **options)
+                      for number, port in enumerate(args.ports)]
+
+    try:
+        results = asyncio.run(record_all(recordings))
+    except KeyboardInterrupt:
+        return
+
+    for group, result in zip(groups, results):
+        print(f"{', '.join(group)}: {'ok' if result else 'failed'}")
+
+
+if __name__ == "__main__":
+    main()
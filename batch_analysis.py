@@ -0,0 +1,98 @@
+import argparse
+import csv
+import json
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+from analysis import MODES, analyse_recordings
+from correlation import load_engine
+from result_cache import ResultCache
+import telemetry
+
+RESULT_FIELDS = ["file_1", "file_2", "distance", "sound_speed", "mode", "status", "error_file", "error_line",
+                 "distance_from_center", "distance_from_first_sensor", "distance_from_second_sensor", "peak_score"]
+
+engine = None
+cache = None
+
+
+def read_manifest(path):
+    with open(path, newline="") as file:
+        if Path(path).suffix == ".json":
+            jobs = json.load(file)
+        else:
+            jobs = list(csv.DictReader(file))
+
+    for job in jobs:
+        job["distance"] = float(job["distance"])
+        job["sound_speed"] = float(job["sound_speed"])
+        job["mode"] = job.get("mode") or "standard"
+        if job["mode"] not in MODES:
+            raise ValueError(f"Unknown analysis mode '{job['mode']}', expected one of {', '.join(MODES)}")
+
+    return jobs
+
+
+def init_worker(cache_directory, telemetry_path):
+    global cache
+    if telemetry_path is not None:
+        telemetry.configure(telemetry_path)
+    if cache_directory is not None:
+        cache = ResultCache(cache_directory)
+
+
+def analyse_pair(job):
+    global engine
+    if engine is None:
+        engine = load_engine()
+
+    result = {field: None for field in RESULT_FIELDS}
+    result.update({key: job[key] for key in ["file_1", "file_2", "distance", "sound_speed", "mode"]})
+
+    analysis = analyse_recordings([job["file_1"], job["file_2"]], job["distance"], job["sound_speed"], job["mode"], engine, cache=cache)
+    if not analysis.success:
+        result["status"] = analysis.reason_of_error
+        if analysis.error_location:
+            result["error_file"], result["error_line"] = analysis.error_location
+        return result
+
+    peak, result_distances = analysis.candidates[0]
+    result["status"] = "ok"
+    result.update(zip(RESULT_FIELDS[-4:-1], result_distances))
+    result["peak_score"] = peak.sidelobe_ratio
+    return result
+
+
+def write_results(path, results):
+    with open(path, "w", newline="") as file:
+        if Path(path).suffix == ".json":
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        else:
+            writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch analysis of sensor recording pairs")
+    parser.add_argument("manifest", help="CSV or JSON manifest with file_1, file_2, distance, sound_speed and optional mode")
+    parser.add_argument("output", help="results file, .csv or .json")
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--cache", nargs="?", const="", default=None, metavar="DIRECTORY",
+                        help="reuse results of recordings analysed before; without a directory the default cache is used")
+    parser.add_argument("--telemetry", metavar="PATH", help="append per-stage timings as JSON lines to PATH, - for stderr")
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    with Pool(processes=args.processes, initializer=init_worker, initargs=(args.cache, args.telemetry)) as pool:
+        results = pool.map(analyse_pair, jobs, chunksize=1)
+
+    write_results(args.output, results)
+
+    failed = sum(result["status"] != "ok" for result in results)
+    print(f"Analysed {len(results)} pairs, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+
+from arduino_imitation import write_signals_in_file, SAMPLE_RATE
+from correlation import load_engine, calculate_distances
+from envelope import min_max_envelope
+from signal_loader import load_recording
+
+SOUND_SPEED = 1430
+SHIFT = 500
+
+
+def plot_result(result_array):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(5, 5), facecolor="white")
+    axes = figure.add_subplot()
+    axes.set_xlim(0, max(len(result_array) - 1, 1))
+    axes.plot(*min_max_envelope(result_array, 0, len(result_array), int(axes.bbox.width)))
+    FigureCanvasAgg(figure).draw()
+
+
+def measure(function, track_memory):
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if track_memory else None
+        if track_memory:
+            tracemalloc.stop()
+
+    return result, seconds, peak_memory
+
+
+def run_stage(report, name, function, samples, track_memory):
+    # Timing comes from a run without tracemalloc, whose hooks slow down
+    # allocation-heavy stages considerably.
+    result, seconds, peak_memory = measure(function, False)
+    if track_memory:
+        peak_memory = measure(function, True)[2]
+
+    report["stages"].append({"stage": name, "samples": samples, "seconds": seconds, "peak_memory_bytes": peak_memory})
+    return result
+
+
+def benchmark_length(length, file_format, engine, track_memory, plot):
+    distance = length * SOUND_SPEED / 33600
+    report = {"samples": length, "distance": distance, "sound_speed": SOUND_SPEED, "file_format": file_format, "stages": []}
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = [f"sensor_1.{file_format}", f"sensor_2.{file_format}"]
+        run_stage(report, "generate", lambda: write_signals_in_file(distance, SOUND_SPEED, directory, directory, names[0], names[1], file_format, length=length, shift=SHIFT, seed=0),
+                  length, track_memory)
+
+        def parse():
+            arrays = [load_recording(f"{directory}/{name}")[0] for name in names]
+            # Memory-mapped recordings are only read when touched.
+            return [numpy.array(array) if isinstance(array, numpy.memmap) else array for array in arrays]
+
+        array_1, array_2 = run_stage(report, "parse", parse, length, track_memory)
+
+    result_array = run_stage(report, "correlate", lambda: engine(array_1, array_2, SOUND_SPEED, distance), length, track_memory)
+    result_distances = run_stage(report, "peaks", lambda: calculate_distances(result_array, distance, SOUND_SPEED), len(result_array), track_memory)
+    if plot:
+        run_stage(report, "plot", lambda: plot_result(result_array), len(result_array), track_memory)
+
+    expected_distance = (distance + SHIFT / SAMPLE_RATE * SOUND_SPEED) / 2
+    report["distance_error"] = abs(result_distances[1] - expected_distance)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the acquisition-to-distance pipeline")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10000, 100000, 1000000], help="recording lengths in samples")
+    parser.add_argument("--format", choices=["txt", "bin", "lfz"], default="txt", dest="file_format")
+    parser.add_argument("--engine", choices=["auto", "dll", "fft"], default=None)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--no-plot", action="store_true", help="skip the matplotlib stage")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    engine = load_engine(args.engine)
+    reports = [benchmark_length(length, args.file_format, engine, not args.no_memory, not args.no_plot) for length in args.lengths]
+    result = {"engine": engine.__name__, "runs": reports}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
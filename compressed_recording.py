@@ -0,0 +1,214 @@
+import argparse
+from collections import namedtuple
+import lzma
+import struct
+import zlib
+
+import numpy
+
+MAGIC = b"LFRZ"
+VERSION = 1
+HEADER = struct.Struct("<4sBcIQddI")
+HEADER_SIZE = HEADER.size
+CHUNK_HEADER = struct.Struct("<IIc")
+CHUNK_SAMPLES = 1 << 16
+
+CODECS = {b"z": (lambda data: zlib.compress(data, 6), zlib.decompress),
+          b"x": (lambda data: lzma.compress(data, preset=6), lzma.decompress)}
+CODEC_CODES = {"zlib": b"z", "lzma": b"x"}
+
+CompressedHeader = namedtuple("CompressedHeader", ["sample_rate", "count", "distance", "sound_speed", "codec", "chunk_samples"])
+
+# Each chunk stands on its own. A smooth signal is stored as differences from
+# the previous sample (wrapping in int16, so any values survive the round
+# trip); noise-like chunks, whose differences span a wider range than the
+# values themselves, are stored as they are. Either way the low and high
+# bytes are stored apart, which leaves the high half almost all 0x00 and 0xFF
+# for the codec.
+
+
+def encode_chunk(samples, compress):
+    deltas = numpy.diff(samples, prepend=numpy.int16(0)).astype("<i2")
+    if len(samples) > 1 and numpy.ptp(deltas[1:].astype(numpy.int32)) < numpy.ptp(samples.astype(numpy.int32)):
+        encoding, values = b"d", deltas
+    else:
+        encoding, values = b"r", samples.astype("<i2")
+    return encoding, compress(values.view(numpy.uint8).reshape(-1, 2).T.tobytes())
+
+
+def decode_chunk(data, count, encoding, decompress, out):
+    data = decompress(data)
+    if len(data) != 2 * count or encoding not in (b"d", b"r"):
+        raise ValueError("Corrupted chunk in compressed recording")
+
+    values = numpy.frombuffer(data, dtype=numpy.uint8).reshape(2, count).T.copy().view("<i2").ravel()
+    if encoding == b"d":
+        numpy.cumsum(values, dtype=numpy.int16, out=out)
+    else:
+        out[:] = values
+
+
+def int16_samples(samples):
+    # Anything but int16 must hold whole numbers int16 can store: a cast
+    # would quietly round fractions and wrap large values.
+    samples = numpy.asarray(samples)
+    if samples.dtype == numpy.int16:
+        return samples
+    if len(samples) and not (numpy.array_equal(samples, numpy.round(samples)) and samples.min() >= -32768 and samples.max() <= 32767):
+        raise ValueError("Samples must be whole numbers from -32768 to 32767")
+    return samples.astype(numpy.int16)
+
+
+class CompressedWriter:
+    def __init__(self, file, sample_rate, distance, sound_speed, codec="zlib", chunk_samples=CHUNK_SAMPLES):
+        self.file = file
+        self.name = file.name
+        self.sample_rate = sample_rate
+        self.distance = distance
+        self.sound_speed = sound_speed
+        self.codec = CODEC_CODES[codec]
+        self.compress = CODECS[self.codec][0]
+        self.chunk_samples = chunk_samples
+
+        self.pending = []
+        self.pending_count = 0
+        self.count = 0
+
+        self.start = file.tell()
+        self.write_header()
+
+    def write_header(self):
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.codec, self.sample_rate, self.count, self.distance, self.sound_speed,
+                                    self.chunk_samples))
+
+    def write(self, samples):
+        samples = int16_samples(samples)
+        self.pending.append(samples)
+        self.pending_count += len(samples)
+        if self.pending_count >= self.chunk_samples:
+            self.write_chunks(final=False)
+        return len(samples) * 2
+
+    def write_chunks(self, final):
+        samples = numpy.concatenate(self.pending) if self.pending else numpy.zeros(0, dtype=numpy.int16)
+        whole = len(samples) if final else len(samples) // self.chunk_samples * self.chunk_samples
+        for start in range(0, whole, self.chunk_samples):
+            chunk = samples[start:start + self.chunk_samples]
+            encoding, data = encode_chunk(chunk, self.compress)
+            self.file.write(CHUNK_HEADER.pack(len(chunk), len(data), encoding))
+            self.file.write(data)
+            self.count += len(chunk)
+
+        self.pending = [samples[whole:]] if whole < len(samples) else []
+        self.pending_count = len(samples) - whole
+
+    def close(self):
+        self.write_chunks(final=True)
+        # The sample count is known only at the end, so the header is
+        # written twice.
+        end = self.file.tell()
+        self.file.seek(self.start)
+        self.write_header()
+        self.file.seek(end)
+
+
+def write_compressed_recording(path, samples, sample_rate, distance, sound_speed, codec="zlib"):
+    samples = int16_samples(samples)
+    with open(path, "wb") as file:
+        writer = CompressedWriter(file, sample_rate, distance, sound_speed, codec)
+        writer.write(samples)
+        writer.close()
+
+
+def is_compressed_recording(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def unpack_header(data, path):
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"File '{path}' is too short to be a compressed recording")
+
+    magic, version, codec, sample_rate, count, distance, sound_speed, chunk_samples = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(f"File '{path}' is not a compressed recording")
+    if version != VERSION or codec not in CODECS:
+        raise ValueError(f"Unsupported compressed recording format in '{path}'")
+
+    return CompressedHeader(sample_rate, count, distance, sound_speed, codec, chunk_samples)
+
+
+def read_compressed_header(path):
+    with open(path, "rb") as file:
+        return unpack_header(file.read(HEADER_SIZE), path)
+
+
+def iter_compressed_chunks(path):
+    with open(path, "rb") as file:
+        header = unpack_header(file.read(HEADER_SIZE), path)
+        decompress = CODECS[header.codec][1]
+
+        decoded = 0
+        while decoded < header.count:
+            data = file.read(CHUNK_HEADER.size)
+            if len(data) < CHUNK_HEADER.size:
+                raise ValueError(f"Compressed recording '{path}' is truncated")
+            count, size, encoding = CHUNK_HEADER.unpack(data)
+
+            chunk = numpy.empty(count, dtype=numpy.int16)
+            try:
+                decode_chunk(file.read(size), count, encoding, decompress, chunk)
+            except (zlib.error, lzma.LZMAError) as error:
+                raise ValueError(f"Corrupted chunk in compressed recording '{path}'") from error
+
+            decoded += count
+            yield chunk
+
+
+def read_compressed_recording(path, on_progress=None):
+    header = read_compressed_header(path)
+    samples = numpy.empty(header.count, dtype=numpy.int16)
+
+    position = 0
+    for chunk in iter_compressed_chunks(path):
+        if position + len(chunk) > header.count:
+            raise ValueError(f"Compressed recording '{path}' holds more samples than its header says")
+        samples[position:position + len(chunk)] = chunk
+        position += len(chunk)
+
+        if on_progress is not None:
+            on_progress(position / header.count)
+
+    return samples
+
+
+def main():
+    from recording_format import is_binary_recording, read_header
+    from signal_loader import load_recording
+
+    parser = argparse.ArgumentParser(description="Convert a text or binary recording into the compressed format")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--codec", choices=list(CODEC_CODES), default="zlib")
+    parser.add_argument("--distance", type=float, default=0, help="for text recordings, which do not store it")
+    parser.add_argument("--sound-speed", type=float, default=0, help="for text recordings, which do not store it")
+    parser.add_argument("--sample-rate", type=int, default=9600)
+    args = parser.parse_args()
+
+    samples, bad_line = load_recording(args.source)
+    if samples is None:
+        parser.error(f"line {bad_line} of {args.source} is not a number")
+
+    sample_rate, distance, sound_speed = args.sample_rate, args.distance, args.sound_speed
+    if is_binary_recording(args.source):
+        header = read_header(args.source)
+        sample_rate, distance, sound_speed = header.sample_rate, header.distance, header.sound_speed
+
+    try:
+        write_compressed_recording(args.destination, samples, sample_rate, distance, sound_speed, args.codec)
+    except ValueError as error:
+        parser.error(f"{args.source}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import ctypes
+import os
+
+import numpy
+
+import telemetry
+
+SAMPLE_RATE = 9600
+# Bump whenever a change to the kernels or peak search alters their output,
+# so cached results computed by the old code are no longer reused.
+CORRELATION_VERSION = 2
+
+# Kfunc.dll correlates a reference block of the first signal, taken one block
+# in, against every lag of the second signal:
+#     result[k] = sum(array_1[n + j] * array_2[k + j] for j in range(n))
+# where n = int(distance / sound_speed * SAMPLE_RATE).
+
+
+def block_length(distance, sound_speed):
+    return int(distance / sound_speed * SAMPLE_RATE)
+
+
+def lags_count(array_length, distance, sound_speed):
+    # K only fills `n` lags; rounding the recording length can ask for one more.
+    return min(round(array_length / 3.5), block_length(distance, sound_speed))
+
+
+def correlate_block(reference, signal, lags):
+    # Recordings stay in their compact dtype; only the samples taking part
+    # are widened, so that float32 input is not transformed in single
+    # precision.
+    reference = numpy.asarray(reference, dtype=numpy.float64)
+    signal = numpy.asarray(signal[:len(reference) + lags - 1], dtype=numpy.float64)
+    fft_size = 1 << (len(reference) + lags - 2).bit_length()
+    spectrum = numpy.conj(numpy.fft.rfft(reference, fft_size)) * numpy.fft.rfft(signal, fft_size)
+    return numpy.fft.irfft(spectrum, fft_size)[:lags]
+
+
+def fft_correlation(array_1, array_2, sound_speed, distance, on_progress=None):
+    n = block_length(distance, sound_speed)
+    lags = lags_count(len(array_1), distance, sound_speed)
+    if n <= 0 or lags <= 0:
+        return numpy.zeros(max(lags, 0))
+
+    if on_progress is None:
+        return correlate_block(array_1[n:2 * n], array_2, lags)
+    # Someone is watching (and may cancel), so the block is correlated in
+    # PROGRESS_STEPS chunks with a report after each.
+    return chunked_correlation(array_1[n:2 * n], array_2, lags, on_progress=on_progress, chunk_length=-(-n // PROGRESS_STEPS))
+
+
+def chained_correlation(arrays, sound_speeds, distances, phat=False, segment_length=None, overlap=0.5, two_sided=False, on_progress=None):
+    # Sensors along a pipeline: segment i lies between arrays[i] and
+    # arrays[i + 1]. All segments share one segment length and FFT size, so
+    # each sensor's spectrum of a segment is computed once and serves both
+    # segments it belongs to.
+    blocks = [block_length(distance, sound_speed) for distance, sound_speed in zip(distances, sound_speeds)]
+    length = min(len(array) for array in arrays)
+    longest = max(blocks)
+    if longest <= 0:
+        return [numpy.zeros(0) for _ in blocks]
+
+    segment_length = min(segment_length or 4 * longest, length)
+    step = max(1, int(segment_length * (1 - overlap)))
+    fft_size = 1 << (segment_length + longest - 1).bit_length()
+
+    # Welch-style average of the cross-spectra of overlapping segments; each
+    # segment is zero-padded, so lags up to n never wrap around.
+    cross_spectra = numpy.zeros((len(blocks), fft_size // 2 + 1), dtype=numpy.complex128)
+    starts = range(0, length - segment_length + 1, step)
+    for number, start in enumerate(starts):
+        previous = numpy.fft.rfft(numpy.asarray(arrays[0][start:start + segment_length], dtype=numpy.float64), fft_size)
+        for index in range(len(blocks)):
+            current = numpy.fft.rfft(numpy.asarray(arrays[index + 1][start:start + segment_length], dtype=numpy.float64), fft_size)
+            cross_spectra[index] += previous * numpy.conj(current)
+            previous = current
+
+        if on_progress is not None:
+            on_progress((number + 1) / len(starts))
+
+    if phat:
+        cross_spectra /= numpy.maximum(numpy.abs(cross_spectra), numpy.finfo(numpy.float64).tiny)
+
+    # correlation[d] pairs arrays[i][j + d] with arrays[i + 1][j]; K reports
+    # the delay d at index n - d for d from n down to 1. Two-sided results go
+    # on to d = -n, which covers the half of the segment K cannot see.
+    correlations = numpy.fft.irfft(cross_spectra, fft_size)
+    if two_sided:
+        return [numpy.concatenate((correlation[n::-1], correlation[:-n - 1:-1])) for correlation, n in zip(correlations, blocks)]
+    return [correlation[n:0:-1].copy() if n > 0 else numpy.zeros(0) for correlation, n in zip(correlations, blocks)]
+
+
+def segmented_correlation(array_1, array_2, sound_speed, distance, phat=False, segment_length=None, overlap=0.5, on_progress=None):
+    return chained_correlation([array_1, array_2], [sound_speed], [distance], phat, segment_length, overlap, on_progress=on_progress)[0]
+
+
+# Measured cost of the FFT path per fft_size * log2(fft_size), in multiply-adds
+# of the direct kernel on one core; only used to pick the cheaper of the two.
+FFT_COST_FACTOR = 6
+# Longest stretch of the reference widened to float64 at a time.
+CHUNK_LENGTH = 1 << 18
+# Chunks of K's single block when progress is reported.
+PROGRESS_STEPS = 8
+
+
+def direct_lags(reference, signal, start, stop):
+    return [numpy.dot(reference, signal[k:k + len(reference)]) for k in range(start, stop)]
+
+
+def correlate_chunk(reference, signal, start, stop, lags, use_fft):
+    # Lag k pairs reference[j] with signal[k + j], so the chunk of the
+    # reference needs the signal from its start to lags - 1 samples past it.
+    chunk = numpy.asarray(reference[start:stop], dtype=numpy.float64)
+    window = numpy.asarray(signal[start:stop + lags - 1], dtype=numpy.float64)
+    if use_fft:
+        return correlate_block(chunk, window, lags)
+    return numpy.array(direct_lags(chunk, window, 0, lags))
+
+
+def chunked_correlation(reference, signal, lags, workers=None, on_progress=None, chunk_length=None):
+    # The reference is split into chunks whose partial correlations add up,
+    # so memory does not grow with the recording, the chunks keep every
+    # worker busy and progress is reported between them.
+    workers = workers or os.cpu_count() or 1
+    chunk_length = chunk_length or min(max(lags, -(-len(reference) // (4 * workers))), CHUNK_LENGTH)
+    fft_size = 1 << (chunk_length + lags - 2).bit_length()
+    # Both paths run on every worker, so the comparison is the same per core.
+    use_fft = lags * chunk_length > FFT_COST_FACTOR * fft_size * fft_size.bit_length()
+
+    # numpy.dot releases the GIL, so threads share the chunks between cores
+    # without copying the recordings into worker processes.
+    bounds = [(start, min(start + chunk_length, len(reference))) for start in range(0, len(reference), chunk_length)]
+    result = numpy.zeros(lags)
+    with ThreadPool(processes=workers) as pool:
+        parts = pool.imap(lambda bound: correlate_chunk(reference, signal, *bound, lags, use_fft), bounds)
+        for (start, stop), part in zip(bounds, parts):
+            result += part
+            if on_progress is not None:
+                on_progress(stop / len(reference))
+
+    return result
+
+
+def windowed_correlation(array_1, array_2, sound_speed, distance, workers=None, on_progress=None, chunk_length=None):
+    # The sound cannot take longer than distance / sound_speed to travel
+    # between the sensors, so only the n lags K reports can hold the leak.
+    # Unlike K, the whole recording after the first block is correlated
+    # against those lags instead of a single block of n samples.
+    n = block_length(distance, sound_speed)
+    length = min(len(array_1), len(array_2))
+    if n <= 0 or length <= n:
+        return numpy.zeros(0)
+
+    return chunked_correlation(array_1[n:length], array_2[:length], n, workers, on_progress, chunk_length)
+
+
+Peak = namedtuple("Peak", ["index", "position", "value", "sidelobe_ratio"])
+
+
+def find_peaks(result_array, count=3, separation=None):
+    result_array = numpy.asarray(result_array, dtype=numpy.float64)
+    length = len(result_array)
+    if length == 0:
+        return []
+    if separation is None:
+        separation = max(1, length // 50)
+
+    padded = numpy.concatenate(([-numpy.inf], result_array, [-numpy.inf]))
+    maxima = numpy.flatnonzero((padded[1:-1] > padded[:-2]) & (padded[1:-1] >= padded[2:]))
+    if len(maxima) == 0:
+        maxima = numpy.array([int(numpy.argmax(result_array))])
+
+    # Only the strongest maxima can survive suppression, so the greedy pick
+    # looks at a short list that grows only if too many of them are too close.
+    chosen = []
+    considered = 0
+    shortlist = min(len(maxima), 16 * count)
+    while len(chosen) < count and considered < len(maxima):
+        best = maxima[numpy.argpartition(-result_array[maxima], shortlist - 1)[:shortlist]]
+        best = best[numpy.argsort(-result_array[best], kind="stable")]
+        chosen = []
+        for index in best:
+            if all(abs(index - other) > separation for other in chosen):
+                chosen.append(index)
+                if len(chosen) == count:
+                    break
+        considered = shortlist
+        shortlist = min(len(maxima), shortlist * 4)
+
+    indices = numpy.array(chosen)
+    values = result_array[indices]
+
+    left = result_array[numpy.maximum(indices - 1, 0)]
+    right = result_array[numpy.minimum(indices + 1, length - 1)]
+    curvature = left - 2 * values + right
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        offsets = numpy.where((curvature < 0) & (indices > 0) & (indices < length - 1), 0.5 * (left - right) / curvature, 0)
+    offsets = numpy.clip(offsets, -0.5, 0.5)
+
+    # Peak-to-sidelobe ratio against everything outside +-separation samples.
+    sums = numpy.concatenate(([0], numpy.cumsum(result_array)))
+    squares = numpy.concatenate(([0], numpy.cumsum(result_array ** 2)))
+    window_start = numpy.maximum(indices - separation, 0)
+    window_stop = numpy.minimum(indices + separation + 1, length)
+    sidelobe_count = length - (window_stop - window_start)
+    sidelobe_sum = sums[-1] - (sums[window_stop] - sums[window_start])
+    sidelobe_squares = squares[-1] - (squares[window_stop] - squares[window_start])
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean = sidelobe_sum / sidelobe_count
+        deviation = numpy.sqrt(numpy.maximum(sidelobe_squares / sidelobe_count - mean ** 2, 0))
+        ratios = numpy.where(deviation > 0, (values - mean) / deviation, numpy.inf)
+
+    return [Peak(int(index), float(index + offset), float(value), float(ratio))
+            for index, offset, value, ratio in zip(indices, offsets, values, ratios)]
+
+
+def distances_for_position(position, lags, distance, sound_speed):
+    t = (lags - position) / SAMPLE_RATE
+    distance_from_first_sensor = (distance + t * sound_speed) / 2
+    distance_from_second_sensor = (distance - t * sound_speed) / 2
+    distance_from_center = max(distance_from_first_sensor, distance_from_second_sensor) - distance / 2
+
+    return [distance_from_center, distance_from_first_sensor, distance_from_second_sensor]
+
+
+def calculate_distances(result_array, distance, sound_speed):
+    return distances_for_position(find_peaks(result_array, count=1)[0].position, len(result_array), distance, sound_speed)
+
+
+def calculate_candidates(result_array, distance, sound_speed, count=3):
+    return [(peak, distances_for_position(peak.position, len(result_array), distance, sound_speed))
+            for peak in find_peaks(result_array, count)]
+
+
+def load_dll_correlation(path="./Kfunc.dll"):
+    lib = ctypes.CDLL(path)
+    lib.K.argtypes = [ctypes.POINTER(ctypes.c_double), ctypes.POINTER(ctypes.c_double), ctypes.c_double, ctypes.c_double]
+    lib.K.restype = ctypes.POINTER(ctypes.c_double)
+
+    def dll_correlation(array_1, array_2, sound_speed, distance, on_progress=None):
+        # K takes doubles, so this is the one place whole recordings are
+        # widened; every other kernel widens a block at a time.
+        with telemetry.stage("ctypes_conversion", samples=len(array_1) + len(array_2)):
+            array_1 = numpy.ascontiguousarray(array_1, dtype=numpy.float64)
+            array_2 = numpy.ascontiguousarray(array_2, dtype=numpy.float64)
+            pointer = ctypes.POINTER(ctypes.c_double)
+
+        # K cannot be interrupted, so the last chance to cancel is once the
+        # recordings are read and widened.
+        if on_progress is not None:
+            on_progress(0.5)
+
+        with telemetry.stage("native_correlation", samples=len(array_1)):
+            result_ptr = lib.K(array_1.ctypes.data_as(pointer), array_2.ctypes.data_as(pointer), sound_speed, distance)
+            return numpy.array(result_ptr[:lags_count(len(array_1), distance, sound_speed)])
+
+    return dll_correlation
+
+
+ENGINES = ("auto", "dll", "fft")
+
+
+def load_engine(name=None):
+    if name is None:
+        name = os.environ.get("LEAK_FINDER_ENGINE", "auto")
+
+    if name not in ENGINES:
+        raise ValueError(f"Unknown correlation engine '{name}', expected one of {', '.join(ENGINES)}")
+
+    if name == "fft":
+        return fft_correlation
+
+    try:
+        return load_dll_correlation()
+    except (OSError, AttributeError):
+        if name == "dll":
+            raise
+        return fft_correlation
@@ -0,0 +1,25 @@
+import math
+
+import numpy
+
+
+def min_max_envelope(data, start, stop, buckets):
+    data = numpy.asarray(data)
+    start = max(0, math.floor(start))
+    stop = min(len(data), math.ceil(stop) + 1)
+    if stop <= start:
+        return numpy.zeros(0), numpy.zeros(0)
+
+    visible = data[start:stop]
+    buckets = max(1, buckets)
+    if len(visible) <= 2 * buckets:
+        return numpy.arange(start, stop), visible
+
+    # Every bucket becomes a vertical stroke from its minimum to its maximum,
+    # so the drawn curve keeps every spike while staying screen-sized.
+    bucket_size = math.ceil(len(visible) / buckets)
+    buckets = math.ceil(len(visible) / bucket_size)
+    padded = numpy.pad(visible, (0, bucket_size * buckets - len(visible)), mode="edge").reshape(buckets, bucket_size)
+    x = numpy.repeat(start + numpy.arange(buckets) * bucket_size + bucket_size / 2, 2)
+    y = numpy.column_stack((padded.min(axis=1), padded.max(axis=1))).ravel()
+    return x, y
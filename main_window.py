@@ -1,3 +1,6 @@
+import time
+
+startup_started = time.perf_counter()
 
 from PyQt6.QtWidgets import QApplication, \
     QMainWindow, \
@@ -13,70 +16,94 @@ from PyQt6.QtWidgets import QApplication, \
     QFileDialog, \
     QMessageBox,\
     QTabWidget,\
-    QLayout
-from PyQt6.QtCore import Qt, pyqtSignal, QObject
+    QLayout,\
+    QProgressBar,\
+    QCheckBox,\
+    QListWidget,\
+    QListWidgetItem
+from PyQt6.QtCore import Qt, pyqtSignal, QObject, QThreadPool, QTimer
 from PyQt6.QtGui import QIcon, QFont
 
-import matplotlib 
-from matplotlib.backends.backend_qt5agg import FigureCanvas
-from matplotlib.figure import Figure
-
-import ctypes
-from threading import Thread
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
-import datetime
-import time
-import sched
-from traceback import format_exc
-from sys import stderr
+import os
+import sys
 
-from arduino_imitation import write_signals_in_file
 from CustomSpinBox import CustomSpinBox
+from recording_scheduler import RecordingScheduler, next_start, job_start, DAY
+
+# numpy, matplotlib and the correlation engine are imported on first use, so
+# the recording tab comes up without waiting for them.
+correlation_engine = None
+result_cache = None
 
-matplotlib.use("Qt5Agg")
+def report_startup(stage, started=startup_started):
+    if os.environ.get("LEAK_FINDER_STARTUP_REPORT"):
+        print(f"{stage}: {time.perf_counter() - started:.3f} s", file=sys.stderr)
 
-lib = ctypes.CDLL("./Kfunc.dll")
-lib.K.argtypes = [ctypes.POINTER(ctypes.c_double), ctypes.POINTER(ctypes.c_double), ctypes.c_double, ctypes.c_double]
-lib.K.restype = ctypes.POINTER(ctypes.c_double)
+def load_analysis_backend():
+    global correlation_engine, result_cache
+    if correlation_engine is None:
+        from correlation import load_engine
+        from result_cache import ResultCache
+
+        started = time.perf_counter()
+        correlation_engine = load_engine()
+        result_cache = ResultCache()
+        report_startup("correlation engine", started)
+
+    return correlation_engine, result_cache
+
+job_statuses = {"pending": "ожидает", "running": "идёт запись", "done": "завершена", "failed": "ошибка", "cancelled": "отменена"}
 
 class CalculationFinishedSignal(QObject):
     calculation_finished = pyqtSignal()
 
+class EstimateUpdatedSignal(QObject):
+    estimate_updated = pyqtSignal(list)
+
+class JobUpdatedSignal(QObject):
+    job_updated = pyqtSignal(object)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
         self.sound_speeds = {"Сталь": 5740, "Медь": 4720, "Полиэтилен": 2000, "Полипропилен": 1430, "Поливинилхлорид": 2395}
         
-        self.analysing_params = {"file_names": None, "calculation_success": None, "reason_of_error": None}
-        self.input_params = {"dir_path": None, "file_name": None, "distance": 0, "sound_speed": 0, "input_result": None}
+        self.analysing_params = {"file_names": None, "calculation_success": None, "reason_of_error": None, "error_location": None}
+        self.input_params = {"dir_path": None, "file_name": None, "distance": 0, "sound_speed": 0}
+
+        self.analysis_worker = None
 
         self.analyse_signal = CalculationFinishedSignal()
         self.analyse_signal.calculation_finished.connect(self.handle_end_of_calculation)
 
-        self.input_signal = CalculationFinishedSignal()
-        self.input_signal.calculation_finished.connect(self.handle_end_of_writing)
-        
-        self.central_widget_layout = QGridLayout()
-        self.canvas = Canvas()
-        self.adjust_central_widget_layout()
+        self.input_signal = JobUpdatedSignal()
+        self.input_signal.job_updated.connect(self.handle_end_of_writing)
 
-        self.central_widget = QWidget()
-        self.central_widget.setLayout(self.central_widget_layout)
-        self.central_widget.setMaximumHeight(500)
+        self.jobs_signal = JobUpdatedSignal()
+        self.jobs_signal.job_updated.connect(lambda job: self.refresh_jobs_list())
 
-        self.analysis_screen_layout = QHBoxLayout()
-        self.adjust_analysis_widget_layout()
+        self.estimate_signal = EstimateUpdatedSignal()
+        self.estimate_signal.estimate_updated.connect(self.show_leak_estimate)
+        
+        self.canvas = None
+        self.central_widget = None
 
         self.input_screen_layout = QGridLayout()
         self.input_screen_layout.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
         self.add_widgets_to_input_screen_layout()
 
+        self.scheduler = RecordingScheduler(self.run_recording_job, on_change=self.jobs_signal.job_updated.emit,
+                                            on_finish=self.input_signal.job_updated.emit)
+        self.refresh_jobs_list()
+        self.scheduler.start()
+
         QToolTip.setFont(QFont("sans-serif", 10, 0))
 
         self.tabs = QTabWidget()
         self.add_tabs()
+        self.tabs.currentChanged.connect(self.build_analysis_screen)
         
         self.setCentralWidget(self.tabs)
         self.adjust_window_appereance()
@@ -119,9 +146,28 @@ class MainWindow(QMainWindow):
         input_screen.setLayout(layout_with_side_widgets)
         self.tabs.addTab(input_screen, "Запись показаний")
 
-        analysis_screen = QWidget()
-        analysis_screen.setLayout(self.analysis_screen_layout)
-        self.tabs.addTab(analysis_screen, "Анализ показаний")
+        self.analysis_screen = QWidget()
+        self.tabs.addTab(self.analysis_screen, "Анализ показаний")
+
+    def build_analysis_screen(self, index):
+        if self.tabs.widget(index) is not self.analysis_screen or self.central_widget is not None:
+            return
+
+        started = time.perf_counter()
+        from plot_canvas import Canvas
+
+        self.central_widget_layout = QGridLayout()
+        self.canvas = Canvas()
+        self.adjust_central_widget_layout()
+
+        self.central_widget = QWidget()
+        self.central_widget.setLayout(self.central_widget_layout)
+        self.central_widget.setMaximumHeight(500)
+
+        self.analysis_screen_layout = QHBoxLayout()
+        self.adjust_analysis_widget_layout()
+        self.analysis_screen.setLayout(self.analysis_screen_layout)
+        report_startup("analysis tab", started)
 
     def add_widgets_to_screen_layout(self):
         self.analysis_screen_layout.addWidget(self.central_widget, alignment=Qt.AlignmentFlag.AlignTop)
@@ -146,7 +192,7 @@ class MainWindow(QMainWindow):
         calculation_button.setStyleSheet("""QPushButton {color: dimgray; background-color: lightgray}
                                          QTooltip {background-color: white; color: black; font-weight: normal}""")
         calculation_button.setMaximumSize(100, 100)
-        self.central_widget_layout.addWidget(calculation_button, 5, 0, 1, 2)
+        self.central_widget_layout.addWidget(calculation_button, 6, 0, 1, 2)
         calculation_button.clicked.connect(self.prepare_for_slow_calculations)
 
         labels_texts = ["Относительно центра: ",
@@ -157,80 +203,89 @@ class MainWindow(QMainWindow):
             label = QLabel(labels_texts[i])
             label.setObjectName(f"distanceLabel{i + 1}")
             label.setStyleSheet("font-size: 14px")
-            self.central_widget_layout.addWidget(label, i + 6, 0, 1, 2)
+            self.central_widget_layout.addWidget(label, i + 7, 0, 1, 2)
+
+        candidates_label = QLabel("")
+        candidates_label.setObjectName("candidatesLabel")
+        candidates_label.setStyleSheet("font-size: 14px")
+        candidates_label.setWordWrap(True)
+        self.central_widget_layout.addWidget(candidates_label, 10, 0, 1, 3)
+
+        progress_layout = QHBoxLayout()
+        progress_layout.setContentsMargins(0, 0, 0, 0)
+
+        progress_bar = QProgressBar()
+        progress_bar.setObjectName("analysisProgressBar")
+        progress_bar.setRange(0, 100)
+        progress_layout.addWidget(progress_bar)
+
+        cancel_button = QPushButton("Отменить")
+        cancel_button.setStyleSheet("""QPushButton {max-width: 100px; padding: 5px; color: white; background-color: navy; border: 0; font-weight: bold}""")
+        cancel_button.clicked.connect(self.cancel_calculation)
+        progress_layout.addWidget(cancel_button)
+
+        progress_widget = QWidget()
+        progress_widget.setObjectName("analysisProgress")
+        progress_widget.setLayout(progress_layout)
+        progress_widget.hide()
+        self.central_widget_layout.addWidget(progress_widget, 11, 0, 1, 3)
 
     def prepare_for_slow_calculations(self):
+        from analysis_worker import AnalysisWorker
+
         distance = self.central_widget.findChild(CustomSpinBox, "distanceSpinBox").value()
         sound_speed = self.central_widget.findChild(CustomSpinBox, "soundSpeedSpinBox").value()
+        mode = self.central_widget.findChild(QComboBox, "modeCombobox").currentData()
 
         calculation_button = self.central_widget.findChild(QPushButton, "calculationButton")
         calculation_button.setText("Загрузка...")
         calculation_button.setCursor(Qt.CursorShape.WaitCursor)
         calculation_button.setDisabled(True)
 
-        thread = Thread(target=self.perform_slow_calculation, args=(distance, sound_speed))
-        thread.start()
-
-    def perform_slow_calculation(self, distance, sound_speed):
-        array_1 = []
-        array_2 = []
-
         self.analysing_params["calculation_success"] = None
         self.analysing_params["reason_of_error"] = None
+        self.analysing_params["error_location"] = None
+
+        progress_bar = self.central_widget.findChild(QProgressBar, "analysisProgressBar")
+        progress_bar.setValue(0)
+        self.central_widget.findChild(QWidget, "analysisProgress").show()
+
+        self.analysis_worker = AnalysisWorker(self.analysing_params["file_names"][:2], distance, sound_speed, mode, *load_analysis_backend())
+        self.analysis_worker.signals.progress.connect(progress_bar.setValue)
+        self.analysis_worker.signals.finished.connect(self.handle_analysis_result)
+        QThreadPool.globalInstance().start(self.analysis_worker)
 
-        with open(self.analysing_params["file_names"][0]) as values_1:
-            for n in values_1:
-                try:
-                    n = float(n)
-                    array_1.append(n)
-                except ValueError:
-                    self.analysing_params["calculation_success"] = 0
-                    self.analysing_params["reason_of_error"] = "value"
-                    break
-
-        with open(self.analysing_params["file_names"][1]) as values_2:
-            for n in values_2:
-                try:
-                    n = float(n)
-                    array_2.append(n)
-                except ValueError:
-                    self.analysing_params["calculation_success"] = 0
-                    self.analysing_params["reason_of_error"] = "value"
-                    break
-                finally:
-                    if self.analysing_params["calculation_success"] == 0:
-                        self.make_button_available()
-
-        length_of_arrays = round(distance / sound_speed * 33600)
-
-        if self.analysing_params["calculation_success"] != 0:
-            if len(array_1) != length_of_arrays or len(array_2) != length_of_arrays:
-                self.analysing_params["calculation_success"] = 0
-                self.analysing_params["reason_of_error"] = "wrong_length"
-                self.make_button_available()
-
-        if self.analysing_params["calculation_success"] != 0:
-            self.analysing_params["calculation_success"] = 1
-            try:
-                array_1 = (ctypes.c_double * length_of_arrays)(*array_1)
-                array_2 = (ctypes.c_double * length_of_arrays)(*array_2)
-                result_ptr = lib.K(array_1, array_2, sound_speed, distance)
-                result_array = result_ptr[:round(len(array_1) / 3.5)]
-                result_distances = self.calculate_distances(result_array, distance, sound_speed)
-
-                self.change_canvas(result_array)
-                self.change_distances_labels(result_distances)
-            except:
-                self.analysing_params["calculation_success"] = 0
-                self.analysing_params["reason_of_error"] = "OS"
-                print(format_exc(10), file=stderr)
-            finally:
-                self.make_button_available()
+    def handle_analysis_result(self, result):
+        self.analysis_worker = None
+        self.central_widget.findChild(QWidget, "analysisProgress").hide()
+
+        self.analysing_params["calculation_success"] = int(result.success)
+        self.analysing_params["reason_of_error"] = result.reason_of_error
+        self.analysing_params["error_location"] = result.error_location
+
+        if result.success:
+            self.change_canvas(result.result_array)
+            self.change_distances_labels(result.candidates[0][1])
+            self.change_candidates_label(result.candidates[1:])
+
+        self.make_button_available()
+
+    def cancel_calculation(self):
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
 
     def handle_end_of_calculation(self):
+        if self.analysing_params["reason_of_error"] == "cancelled":
+            self.analysing_params["calculation_success"] = None
+            self.analysing_params["reason_of_error"] = None
+            return
+
         if not self.analysing_params["calculation_success"]:
             if self.analysing_params["reason_of_error"] == "value":
                 informative_text = "В файле должны быть только дробные числа, после которых стоит знак переноса. Целая часть от дробной должна отделяться точкой."
+                if self.analysing_params["error_location"]:
+                    name, line = self.analysing_params["error_location"]
+                    informative_text += f" Ошибка в файле {name[name.rindex('/') + 1:]}, строка {line}."
             else:
                 informative_text = "Проверьте правильность данных, записанных в файл."
 
@@ -240,9 +295,7 @@ class MainWindow(QMainWindow):
             for key in self.analysing_params:
                 self.analysing_params[key] = None
 
-            self.canvas.axes.clear()
-            self.right_column_layout.removeWidget(self.canvas)
-            self.right_column_layout.addWidget(self.canvas)
+            self.canvas.clear_result()
             self.canvas.setToolTip("Здесь будет график")
 
     def show_error(self, main_text="", informative_text=""):
@@ -276,16 +329,14 @@ class MainWindow(QMainWindow):
             label = self.central_widget.findChild(QLabel, f"distanceLabel{i + 1}")
             label.setText(labels_texts[i])
 
+        self.central_widget.findChild(QLabel, "candidatesLabel").setText("")
+
     def change_canvas(self, result_array):
-        self.canvas.axes.clear()
         try:
-            self.canvas.axes.plot(list(range(len(result_array))), result_array)
+            self.canvas.set_result(result_array)
             self.canvas.setToolTip("")
         except OverflowError:
             self.show_error(main_text="Произошла ошибка при построении графика.", informative_text="Проверьте правильность данных, введённых в файл.")
-        finally:
-            self.right_column_layout.removeWidget(self.canvas)
-            self.right_column_layout.addWidget(self.canvas)
         
     def make_button_available(self):
         calculation_button = self.central_widget.findChild(QPushButton, "calculationButton")
@@ -304,16 +355,18 @@ class MainWindow(QMainWindow):
             label = self.central_widget.findChild(QLabel, f"distanceLabel{i + 1}")
             label.setText(labels_texts[i] + str(round(result_distances[i], 2)) + " м")
 
-    def calculate_distances(self, result_array, distance, sound_speed):
-        t = (len(result_array) - result_array.index(max(result_array))) / 9600
-        distance_from_first_sensor = (distance + t * sound_speed) / 2
-        distance_from_second_sensor = (distance - t * sound_speed) / 2
-        distance_from_center = max(distance_from_first_sensor, distance_from_second_sensor) - distance / 2
+    def change_candidates_label(self, candidates):
+        candidates_label = self.central_widget.findChild(QLabel, "candidatesLabel")
+        if not candidates:
+            candidates_label.setText("")
+            return
 
-        return [distance_from_center, distance_from_first_sensor, distance_from_second_sensor]
+        texts = [f"{round(result_distances[1], 2)} м от датчика A (выраженность пика {round(peak.sidelobe_ratio, 1)})"
+                 for peak, result_distances in candidates]
+        candidates_label.setText("Другие возможные места утечки: " + "; ".join(texts))
 
     def add_labels(self):
-        labels_texts = ["Скорость звука, м/с:", "Расстояние между датчиками, м:", "Материал трубы:"]
+        labels_texts = ["Скорость звука, м/с:", "Расстояние между датчиками, м:", "Материал трубы:", "Метод расчёта:"]
 
         for i in range(len(labels_texts)):
             label = QLabel(labels_texts[i])
@@ -344,6 +397,15 @@ class MainWindow(QMainWindow):
         material_combobox.currentTextChanged.connect(self.change_sound_speed)
         self.central_widget_layout.addWidget(material_combobox, 4, 2)
 
+        mode_combobox = QComboBox()
+        mode_combobox.setObjectName("modeCombobox")
+        mode_combobox.addItem("Стандартный", "standard")
+        mode_combobox.addItem("Усреднение по сегментам", "segments")
+        mode_combobox.addItem("Усреднение по сегментам (PHAT)", "segments_phat")
+        mode_combobox.addItem("Окно допустимых задержек", "window")
+        mode_combobox.setStyleSheet("max-width: 165px; background-color: white; border: 1px solid gainsboro")
+        self.central_widget_layout.addWidget(mode_combobox, 5, 2)
+
     def add_choice_button(self):
         file_choice_button = QPushButton("Выберите 2 файла")
         file_choice_button.setObjectName("fileChoiceButton")
@@ -380,7 +442,7 @@ class MainWindow(QMainWindow):
 
 
     def open_files_and_record_names(self):
-         file_names = QFileDialog.getOpenFileNames(self, "Выбор файлов", "", filter="Текстовые файлы (*.txt)")
+         file_names = QFileDialog.getOpenFileNames(self, "Выбор файлов", "", filter="Записи датчиков (*.txt *.bin *.lfz)")
          if len(file_names[0]) > 1:
             self.analysing_params["file_names"] = file_names[0]
 
@@ -414,6 +476,9 @@ class MainWindow(QMainWindow):
         label.setStyleSheet("font-weight: 600; color: #033E6B")
         self.right_column_layout.addWidget(label)
         self.canvas.setToolTip("Здесь будет график")
+
+        from plot_canvas import NavigationToolbar
+        self.right_column_layout.addWidget(NavigationToolbar(self.canvas, self))
         self.right_column_layout.addWidget(self.canvas)
 
     def add_widgets_to_input_screen_layout(self):
@@ -421,7 +486,7 @@ class MainWindow(QMainWindow):
         title.setStyleSheet("font-weight: 600; color: #033E6B")
         self.input_screen_layout.addWidget(title, 0, 0, 1, 2)
 
-        labels = ["Папка, куда будет записан файл: ", "Имя файла: ", "Время запуска: ", "Расстояние между датчиками: ", "Скорость звука в трубе: "]
+        labels = ["Папка, куда будет записан файл: ", "Имя файла: ", "Время запуска: ", "Расстояние между датчиками: ", "Скорость звука в трубе: ", "Формат файла: ", "Повторять ежедневно: "]
         for i in range(len(labels)):
             label = QLabel(labels[i])
             self.input_screen_layout.addWidget(label, i + 1, 0)
@@ -448,6 +513,11 @@ class MainWindow(QMainWindow):
         self.add_file_name_input()
 
         self.add_spinboxes()
+        self.add_file_format_combobox()
+
+        repeat_checkbox = QCheckBox()
+        repeat_checkbox.setObjectName("repeatCheckbox")
+        self.input_screen_layout.addWidget(repeat_checkbox, 7, 1)
 
         record_start_button = QPushButton("Начать запись")
         record_start_button.setObjectName("recordStartButton")
@@ -456,7 +526,62 @@ class MainWindow(QMainWindow):
         record_start_button.setToolTip("Заполните все поля")
         record_start_button.setDisabled(True)
         record_start_button.clicked.connect(self.show_confirmation_and_start_scheduling)
-        self.input_screen_layout.addWidget(record_start_button, 6, 0, 1, 2)
+        self.input_screen_layout.addWidget(record_start_button, 8, 0, 1, 2)
+
+        leak_estimate_label = QLabel("")
+        leak_estimate_label.setObjectName("leakEstimate")
+        self.input_screen_layout.addWidget(leak_estimate_label, 9, 0, 1, 2)
+
+        self.add_jobs_list()
+
+    def add_jobs_list(self):
+        title = QLabel(f"<h3>Запланированные записи</h3>")
+        title.setStyleSheet("font-weight: 600; color: #033E6B")
+        self.input_screen_layout.addWidget(title, 10, 0, 1, 2)
+
+        jobs_list = QListWidget()
+        jobs_list.setObjectName("jobsList")
+        jobs_list.setStyleSheet("background-color: white")
+        jobs_list.setMaximumHeight(150)
+        self.input_screen_layout.addWidget(jobs_list, 11, 0, 1, 2)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.setContentsMargins(0, 0, 0, 0)
+
+        cancel_button = QPushButton("Отменить запись")
+        cancel_button.setStyleSheet("QPushButton {padding: 5px; color: white; background-color: navy; border: 0; font-weight: bold}")
+        cancel_button.clicked.connect(self.cancel_selected_job)
+        buttons_layout.addWidget(cancel_button)
+
+        clear_button = QPushButton("Убрать завершённые")
+        clear_button.setStyleSheet("QPushButton {padding: 5px; color: white; background-color: navy; border: 0; font-weight: bold}")
+        clear_button.clicked.connect(self.remove_finished_jobs)
+        buttons_layout.addWidget(clear_button)
+
+        buttons = QWidget()
+        buttons.setLayout(buttons_layout)
+        self.input_screen_layout.addWidget(buttons, 12, 0, 1, 2)
+
+    def refresh_jobs_list(self):
+        jobs_list = self.findChild(QListWidget, "jobsList")
+        jobs_list.clear()
+        for job in self.scheduler.jobs():
+            text = f"{job_start(job).strftime('%d.%m.%y, %H:%M')} — {job['params']['file_name']} — {job_statuses[job['status']]}"
+            if job["interval"]:
+                text += " (ежедневно)"
+
+            item = QListWidgetItem(text)
+            item.setData(Qt.ItemDataRole.UserRole, job["id"])
+            jobs_list.addItem(item)
+
+    def cancel_selected_job(self):
+        item = self.findChild(QListWidget, "jobsList").currentItem()
+        if item is not None:
+            self.scheduler.cancel(item.data(Qt.ItemDataRole.UserRole))
+
+    def remove_finished_jobs(self):
+        self.scheduler.remove_finished()
+        self.refresh_jobs_list()
 
     def write_value(self, param, value):
         self.input_params[param] = value
@@ -491,7 +616,10 @@ class MainWindow(QMainWindow):
         file_name.setMaximumWidth(150)
         file_name.textChanged.connect(lambda: self.write_value("file_name", file_name.text()))
         file_name_layout.addWidget(file_name)
-        file_name_layout.addWidget(QLabel(".txt"))
+
+        file_extension = QLabel(".txt")
+        file_extension.setObjectName("fileExtension")
+        file_name_layout.addWidget(file_extension)
 
         file_name_widget = QWidget()
         file_name_widget.setLayout(file_name_layout)
@@ -539,39 +667,17 @@ class MainWindow(QMainWindow):
         spinboxes_wrapper.setLayout(spinboxes_layout)
         self.input_screen_layout.addWidget(spinboxes_wrapper, 3, 1, Qt.AlignmentFlag.AlignLeft)
 
+    def add_file_format_combobox(self):
+        file_format_combobox = QComboBox()
+        file_format_combobox.setObjectName("fileFormatCombobox")
+        file_format_combobox.addItem("Текстовый (.txt)", "txt")
+        file_format_combobox.addItem("Двоичный (.bin)", "bin")
+        file_format_combobox.addItem("Сжатый (.lfz)", "lfz")
+        file_format_combobox.setStyleSheet("max-width: 150px; background-color: white; border: 1px solid gainsboro")
+        file_format_combobox.currentIndexChanged.connect(
+            lambda: self.findChild(QLabel, "fileExtension").setText("." + file_format_combobox.currentData()))
+        self.input_screen_layout.addWidget(file_format_combobox, 6, 1)
 
-    def find_date(self, hours, minutes):
-        now = datetime.datetime.now()
-
-        days_in_months = {
-            1: 31,
-            3: 31,
-            4: 30,
-            5: 31,
-            6: 30,
-            7: 31,
-            8: 31,
-            9: 30,
-            10: 31,
-            11: 30
-        }
-
-        if now.hour > hours or (now.hour == hours and now.minute > minutes):
-            if now.month == 12 and now.day == 31:
-                return datetime.datetime(now.year + 1, 1, 1, hours, minutes)
-            elif now.month == 2:
-                if (now.day == 29 and now.year % 4 == 0) or (now.day == 28 and now.year % 4 != 0):
-                    return datetime.datetime(now.year, 3, 1, hours, minutes)
-                else:
-                    return datetime.datetime(now.year, now.month, now.day + 1, hours, minutes)
-            else:
-                if now.day == days_in_months[now.month]:
-                   return datetime.datetime(now.year, now.month + 1, 1, hours, minutes)
-                else:
-                    return datetime.datetime(now.year, now.month, now.day + 1, hours, minutes)
-                
-        return datetime.datetime(now.year, now.month, now.day, hours, minutes)
-    
     def change_state_of_start_button(self):
         values = [self.input_params[key] for key in self.input_params]
         record_start_button = self.findChild(QPushButton, "recordStartButton")
@@ -589,40 +695,38 @@ class MainWindow(QMainWindow):
         start_hour = self.findChild(CustomSpinBox, "startHour").value()
         start_minute = self.findChild(CustomSpinBox, "startMinute").value()
 
-        date_of_start = self.find_date(start_hour, start_minute)
+        date_of_start = next_start(start_hour, start_minute)
         date_string = date_of_start.strftime("%d.%m.%y, %H:%M")
 
         self.input_params["distance"] = self.findChild(CustomSpinBox, "input_distance").value()
         self.input_params["sound_speed"] = self.findChild(CustomSpinBox, "input_soundSpeed").value()
 
-        confirm_pop_up = self.create_confirm_pop_up({"date_string": date_string})
+        file_format = self.findChild(QComboBox, "fileFormatCombobox").currentData()
+        repeat = self.findChild(QCheckBox, "repeatCheckbox").isChecked()
 
-        pool = ThreadPool(processes=1)
-        input_params = self.input_params
-        input_signal = self.input_signal
+        confirm_pop_up = self.create_confirm_pop_up({"date_string": date_string, "repeat": repeat})
+        if not confirm_pop_up.exec():
+            return
 
-        def get_result_of_writing():
-            async_result = pool.apply_async(write_signals_in_file, [input_params[key] for key in ["distance", "sound_speed"]] + [input_params["dir_path"] for i in range(2)] + [input_params["file_name"] + ".txt"] + [input_params["file_name"] + "_1.txt"])
-            async_result.wait()
-            a = async_result.get()
-            input_params["input_result"] = a
-            input_signal.calculation_finished.emit()
+        params = {key: self.input_params[key] for key in ["dir_path", "file_name", "distance", "sound_speed"]}
+        params["file_format"] = file_format
+        self.scheduler.add(date_of_start, params, DAY if repeat else None)
+        self.reset_input_form()
 
-        schedule = sched.scheduler(time.time, time.sleep)
-        event = schedule.enter((date_of_start - datetime.datetime.now()).total_seconds(), 1, get_result_of_writing)
+    def run_recording_job(self, job, stop):
+        from arduino_imitation import write_signals_in_file
+        from streaming import StreamingCorrelator
 
-        thread = Thread(target=self.start_writing, args=[schedule])
-        thread.start()
-        
-        result = confirm_pop_up.exec()
-        if not result and self.input_params["input_result"] == None:
-            pool.close()
-            try:
-                schedule.cancel(event)
-            except ValueError:
-                pass
-            finally:
-                self.change_state_of_start_button()
+        params = job["params"]
+        file_name = params["file_name"]
+        if job["interval"]:
+            # Every run of a recurring recording gets its own files.
+            file_name += job_start(job).strftime("_%Y%m%d_%H%M")
+        file_format = params["file_format"]
+
+        correlator = StreamingCorrelator(params["distance"], params["sound_speed"], on_update=self.estimate_signal.estimate_updated.emit)
+        return write_signals_in_file(params["distance"], params["sound_speed"], params["dir_path"], params["dir_path"],
+                                     f"{file_name}.{file_format}", f"{file_name}_1.{file_format}", file_format, correlator, stop=stop)
 
     def create_confirm_pop_up(self, params: dict):
         confirm_pop_up = QMessageBox(self)
@@ -636,20 +740,20 @@ class MainWindow(QMainWindow):
                                             <b>Папка, в которой будет находиться файл:</b> {self.input_params["dir_path"]}<br />
                                             <b>Расстояние между датчиками:</b> {self.input_params["distance"]}<br />
                                             <b>Скорость звука в трубе:</b> {self.input_params["sound_speed"]}<br />
-                                            <b>Дата и время начала записи:</b> {params["date_string"]}<br />
-                                            <i>(По наступлении этого времени запись начнётся автоматически, если Вы не закроете программу и не нажмёте кнопку "Отмена")</i>
+                                            <b>Дата и время начала записи:</b> {params["date_string"]}{" (ежедневно)" if params["repeat"] else ""}<br />
+                                            <i>(По наступлении этого времени запись начнётся автоматически. Если программа будет закрыта, запись начнётся при следующем запуске)</i>
                                           """)
         
         return confirm_pop_up
         
-    def handle_end_of_writing(self):
-        result = self.input_params["input_result"]
-        if not result:
+    def handle_end_of_writing(self, job):
+        if not job["last_result"]:
             self.show_error("Не удалось записать данные в файл.", "Проверьте правильность введённых данных, в частности, номер COM-порта.")
         else:
-            dir_path = self.input_params["dir_path"]
+            dir_path = job["params"]["dir_path"]
             self.show_info("Данные успешно записаны в файл.", f"Файл находится в папке <i>{dir_path}</i>")
 
+    def reset_input_form(self):
         self.dir_button = self.findChild(QPushButton, "dirChooseButton")
         self.dir_button.setText("Выберите папку")
         self.dir_button.setStyleSheet("QPushButton {max-width: 120px; padding: 5px; color: white; background-color: navy; border: 0; font-weight: bold}")
@@ -662,21 +766,17 @@ class MainWindow(QMainWindow):
             self.findChild(CustomSpinBox, name).setValue(0)
 
         self.findChild(QLineEdit, "fileName").setText("")
-
-        confirm_pop_up = self.findChild(QMessageBox, "confirmPopUp")
-        if confirm_pop_up:
-            confirm_pop_up.close()
+        self.findChild(QComboBox, "fileFormatCombobox").setCurrentIndex(0)
+        self.findChild(QCheckBox, "repeatCheckbox").setChecked(False)
+        self.findChild(QLabel, "leakEstimate").setText("")
 
         for key in self.input_params:
             self.input_params[key] = None
+        self.change_state_of_start_button()
 
-    def start_writing(self, schedule):
-        record_start_button = self.findChild(QPushButton, "recordStartButton")
-        record_start_button.setDisabled(True)
-        record_start_button.setStyleSheet("""QPushButton {color: dimgray; font-weight: normal; background-color: lightgray; max-width: 100px}
-                                         QTooltip {background-color: white; color: black; font-weight: normal}""")
-        record_start_button.setToolTip("Дождитесь окончания предыдущей записи")
-        schedule.run()
+    def show_leak_estimate(self, result_distances):
+        self.findChild(QLabel, "leakEstimate").setText(f"Предварительная оценка: {round(result_distances[1], 2)} м от датчика A, "
+                                                       f"{round(result_distances[2], 2)} м от датчика B")
 
     def show_info(self, main_text="", informative_text=""):
         info_box = QMessageBox(self)
@@ -687,17 +787,19 @@ class MainWindow(QMainWindow):
         info_box.setStandardButtons(QMessageBox.StandardButton.Ok)
 
         info_box.exec()
-    
 
-class Canvas(FigureCanvas):
-    def __init__(self) -> None:
-        figure = Figure(figsize=(500, 500), facecolor="white")
-        self.axes = figure.add_subplot()
-        super().__init__(figure)
+    def closeEvent(self, event):
+        self.scheduler.stop()
+        super().closeEvent(event)
+    
 
 app = QApplication([])
 
+report_startup("imports")
+
 window = MainWindow()
 window.show()
+report_startup("window created")
+QTimer.singleShot(0, lambda: report_startup("window shown"))
         
 app.exec()
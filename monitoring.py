@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+from collections import deque, namedtuple
+import csv
+from itertools import islice
+import sys
+
+import numpy
+import serial.serialutil
+
+from correlation import SAMPLE_RATE, block_length, calculate_candidates
+
+MonitoringUpdate = namedtuple("MonitoringUpdate", ["time", "position", "value", "score", "distances", "stable"])
+
+UPDATE_FIELDS = ["time", "position", "value", "score", "distance_from_center", "distance_from_first_sensor",
+                 "distance_from_second_sensor", "stable"]
+
+
+class SlidingCorrelator:
+    # The cross-spectrum of the last `window_blocks` blocks is kept as a
+    # running sum: every block adds its own spectrum and takes away the one
+    # that leaves the window, so an update costs the same after an hour as
+    # after a month.
+    def __init__(self, distance, sound_speed, window_blocks=32, block_size=None, phat=False, history=3600,
+                 stable_updates=10, min_score=5.0, tolerance=None, on_update=None, on_alert=None):
+        self.distance = distance
+        self.sound_speed = sound_speed
+        self.window_blocks = window_blocks
+        self.phat = phat
+        self.min_score = min_score
+        self.stable_updates = stable_updates
+        self.on_update = on_update
+        self.on_alert = on_alert
+
+        self.lags = block_length(distance, sound_speed)
+        if self.lags <= 0:
+            raise ValueError("The distance between the sensors is too short for the sample rate")
+        self.block_size = block_size or 4 * self.lags
+        self.tolerance = tolerance if tolerance is not None else max(1, self.lags // 100)
+        # Every block is zero-padded, so lags up to n never wrap around.
+        self.fft_size = 1 << (self.block_size + self.lags - 1).bit_length()
+
+        self.block = numpy.empty((2, self.block_size))
+        self.filled = 0
+        self.samples_count = 0
+
+        self.spectra = deque()
+        self.cross_spectrum = numpy.zeros(self.fft_size // 2 + 1, dtype=numpy.complex128)
+        self.blocks_since_sum = 0
+
+        self.history = deque(maxlen=max(history, stable_updates))
+        self.alerted = False
+
+    def add_samples(self, samples_1, samples_2):
+        samples_1 = numpy.asarray(samples_1)
+        samples_2 = numpy.asarray(samples_2)
+        position = 0
+        while position < len(samples_1):
+            count = min(self.block_size - self.filled, len(samples_1) - position)
+            self.block[0, self.filled:self.filled + count] = samples_1[position:position + count]
+            self.block[1, self.filled:self.filled + count] = samples_2[position:position + count]
+            self.filled += count
+            position += count
+
+            if self.filled == self.block_size:
+                self.process_block()
+                self.filled = 0
+
+    def process_block(self):
+        spectrum = numpy.fft.rfft(self.block[0], self.fft_size) * numpy.conj(numpy.fft.rfft(self.block[1], self.fft_size))
+        self.samples_count += self.block_size
+
+        self.spectra.append(spectrum)
+        self.cross_spectrum += spectrum
+        if len(self.spectra) > self.window_blocks:
+            self.cross_spectrum -= self.spectra.popleft()
+
+        # Adding and taking away leaves rounding errors behind; summing the
+        # window afresh once per window keeps them from piling up.
+        self.blocks_since_sum += 1
+        if self.blocks_since_sum >= self.window_blocks:
+            self.cross_spectrum = numpy.sum(self.spectra, axis=0)
+            self.blocks_since_sum = 0
+
+        self.publish(self.correlation())
+
+    def correlation(self):
+        cross_spectrum = self.cross_spectrum
+        if self.phat:
+            cross_spectrum = cross_spectrum / numpy.maximum(numpy.abs(cross_spectrum), numpy.finfo(numpy.float64).tiny)
+        # Same orientation as K: index n - d holds the delay d.
+        return numpy.fft.irfft(cross_spectrum, self.fft_size)[self.lags:0:-1]
+
+    def publish(self, result_array):
+        peak, result_distances = calculate_candidates(result_array, self.distance, self.sound_speed, count=1)[0]
+        stable = self.is_stable(peak)
+        update = MonitoringUpdate(self.samples_count / SAMPLE_RATE, peak.position, peak.value, peak.sidelobe_ratio,
+                                  tuple(result_distances), stable)
+        self.history.append(update)
+
+        if self.on_update is not None:
+            self.on_update(update)
+
+        # One alert per stable peak; it fires again only after the peak has
+        # wandered off or faded and then settled once more.
+        if stable and not self.alerted and self.on_alert is not None:
+            self.on_alert(update)
+        self.alerted = stable
+
+    def is_stable(self, peak):
+        if len(self.history) < self.stable_updates - 1 or peak.sidelobe_ratio < self.min_score:
+            return False
+
+        recent = list(islice(reversed(self.history), self.stable_updates - 1))
+        positions = [update.position for update in recent] + [peak.position]
+        return (all(update.score >= self.min_score for update in recent)
+                and max(positions) - min(positions) <= 2 * self.tolerance)
+
+
+def feed_recordings(correlator, pairs, chunk_samples=1 << 16):
+    from signal_loader import load_recording
+
+    for file_name_1, file_name_2 in pairs:
+        (array_1, bad_line_1), (array_2, bad_line_2) = load_recording(file_name_1), load_recording(file_name_2)
+        if array_1 is None or array_2 is None:
+            bad_file, bad_line = (file_name_1, bad_line_1) if array_1 is None else (file_name_2, bad_line_2)
+            raise ValueError(f"Line {bad_line} of {bad_file} is not a number")
+
+        length = min(len(array_1), len(array_2))
+        for start in range(0, length, chunk_samples):
+            correlator.add_samples(array_1[start:start + chunk_samples], array_2[start:start + chunk_samples])
+
+
+async def monitor_ports(com_ports, correlator, baud_rate=9600, framing="text", timeout=5, max_skew=480):
+    from arduino import ChannelAligner
+    from async_acquisition import PortReader, open_port, watch
+
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    aligner = ChannelAligner(SAMPLE_RATE, max_skew)
+    signals = []
+    readers = []
+
+    def on_samples(channel, samples):
+        aligner.add_block(channel, loop.time(), samples)
+        block_1, block_2 = aligner.take()
+        if len(block_1):
+            correlator.add_samples(block_1, block_2)
+
+    def on_reader_done(done):
+        if not stopped.done():
+            if done.exception() is not None:
+                stopped.set_exception(done.exception())
+            else:
+                stopped.set_result(None)
+
+    try:
+        for com_port in com_ports:
+            signals.append(open_port(com_port, baud_rate))
+        # The readers never reach their length; monitoring ends only when a
+        # sensor fails or the task is cancelled.
+        readers = [PortReader(signal, sys.maxsize, framing, lambda samples, channel=channel: on_samples(channel, samples))
+                   for channel, signal in enumerate(signals)]
+        for reader in readers:
+            reader.done.add_done_callback(on_reader_done)
+            reader.start()
+
+        await watch(readers, stopped, timeout)
+    finally:
+        for reader in readers:
+            reader.stop()
+        for signal in signals:
+            signal.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a sensor pair continuously and report where the correlation peak sits")
+    parser.add_argument("sources", nargs="+",
+                        help="two COM ports, or with --recordings pairs of recordings in the order they were made")
+    parser.add_argument("--recordings", action="store_true", help="read recording pairs instead of live ports")
+    parser.add_argument("--distance", type=float, required=True)
+    parser.add_argument("--sound-speed", type=float, required=True)
+    parser.add_argument("--window", type=int, default=32, help="blocks in the sliding window")
+    parser.add_argument("--block", type=int, help="samples per block, four times the longest delay by default")
+    parser.add_argument("--phat", action="store_true", help="whiten the cross-spectrum (PHAT)")
+    parser.add_argument("--stable-updates", type=int, default=10, help="updates the peak must hold still before an alert")
+    parser.add_argument("--min-score", type=float, default=5.0, help="lowest peak-to-sidelobe ratio of a stable peak")
+    parser.add_argument("--output", help="CSV file for the peak time series, standard output by default")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--framing", choices=["text", "binary"], default="text")
+    args = parser.parse_args()
+
+    if len(args.sources) % 2 or (not args.recordings and len(args.sources) != 2):
+        parser.error("give two COM ports, or pairs of recordings with --recordings")
+
+    output = open(args.output, "a", newline="", buffering=1) if args.output else sys.stdout
+    writer = csv.writer(output)
+    if output is sys.stdout or output.tell() == 0:
+        writer.writerow(UPDATE_FIELDS)
+
+    def on_update(update):
+        writer.writerow([f"{update.time:.2f}", f"{update.position:.2f}", update.value, f"{update.score:.2f}",
+                         *(f"{value:.2f}" for value in update.distances), int(update.stable)])
+
+    def on_alert(update):
+        print(f"Stable peak at {update.time:.0f} s: {update.distances[1]:.1f} m from the first sensor, "
+              f"{update.distances[2]:.1f} m from the second, score {update.score:.2f}", file=sys.stderr)
+
+    correlator = SlidingCorrelator(args.distance, args.sound_speed, args.window, args.block, args.phat,
+                                   stable_updates=args.stable_updates, min_score=args.min_score,
+                                   on_update=on_update, on_alert=on_alert)
+    try:
+        if args.recordings:
+            feed_recordings(correlator, zip(args.sources[::2], args.sources[1::2]))
+        else:
+            asyncio.run(monitor_ports(args.sources, correlator, args.baud, args.framing))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError, serial.serialutil.SerialException) as error:
+        print(error, file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+from collections import namedtuple
+from itertools import accumulate
+from traceback import format_exc
+from sys import stderr
+
+from analysis import AnalysisCancelled, failure, load_arrays, scaled_progress
+from correlation import chained_correlation, distances_for_position, find_peaks
+import telemetry
+
+SurveyCandidate = namedtuple("SurveyCandidate", ["segment", "peak", "distances", "line_position"])
+SurveyResult = namedtuple("SurveyResult", ["success", "reason_of_error", "error_location", "result_arrays", "candidates"])
+
+
+def survey_failure(result):
+    return SurveyResult(False, result.reason_of_error, result.error_location, None, ())
+
+
+def line_candidates(result_arrays, distances, sound_speeds, count=3):
+    # A peak in segment i is placed on the line by adding the distance from
+    # the segment's first sensor to where that sensor stands. A peak at
+    # either end of the delays means the sound came from beyond a sensor, and
+    # the neighbouring segment places that leak itself.
+    sensor_positions = [0, *accumulate(distances)]
+    candidates = []
+    for segment, (result_array, distance, sound_speed) in enumerate(zip(result_arrays, distances, sound_speeds)):
+        lags = (len(result_array) - 1) // 2
+        for peak in find_peaks(result_array, count):
+            if peak.index in (0, len(result_array) - 1):
+                continue
+            result_distances = tuple(distances_for_position(peak.position, lags, distance, sound_speed))
+            candidates.append(SurveyCandidate(segment, peak, result_distances, sensor_positions[segment] + result_distances[1]))
+
+    candidates.sort(key=lambda candidate: candidate.peak.sidelobe_ratio, reverse=True)
+    return tuple(candidates)
+
+
+def survey_recordings(file_names, distances, sound_speeds, phat=False, count=3, on_progress=None):
+    if len(file_names) < 2 or len(distances) != len(file_names) - 1 or len(sound_speeds) != len(distances):
+        raise ValueError("A survey needs N recordings and N - 1 segment distances and sound speeds")
+
+    report = on_progress or (lambda fraction: None)
+    # Every recording takes part in the longest segment it may belong to, so
+    # all of them must be long enough for the longest one.
+    length_of_arrays = max(round(distance / sound_speed * 33600) for distance, sound_speed in zip(distances, sound_speeds))
+
+    arrays, error = load_arrays(file_names, length_of_arrays, "segments", on_progress)
+    if error is not None:
+        return survey_failure(error)
+    report(0.5)
+
+    try:
+        with telemetry.stage("correlation", mode="survey", sensors=len(arrays), samples=min(len(array) for array in arrays)):
+            result_arrays = chained_correlation(arrays, sound_speeds, distances, phat, two_sided=True,
+                                                on_progress=scaled_progress(on_progress, 0.5, 0.95))
+        report(0.95)
+
+        with telemetry.stage("peak_detection", samples=sum(len(result_array) for result_array in result_arrays)):
+            candidates = line_candidates(result_arrays, distances, sound_speeds, count)
+    except AnalysisCancelled:
+        raise
+    except Exception:
+        print(format_exc(10), file=stderr)
+        return survey_failure(failure("OS"))
+
+    for result_array in result_arrays:
+        result_array.flags.writeable = False
+    report(1)
+    return SurveyResult(True, None, None, tuple(result_arrays), candidates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find leaks along a pipeline with sensors at both ends of every segment")
+    parser.add_argument("recordings", nargs="+", help="recordings of the sensors in the order they stand along the line")
+    parser.add_argument("--distances", type=float, nargs="+", required=True, help="length of every segment between neighbouring sensors")
+    parser.add_argument("--sound-speeds", type=float, nargs="+", required=True,
+                        help="sound speed in every segment, or one value for the whole line")
+    parser.add_argument("--phat", action="store_true", help="whiten the cross-spectra (PHAT)")
+    parser.add_argument("--count", type=int, default=3, help="candidates per segment")
+    args = parser.parse_args()
+
+    sound_speeds = args.sound_speeds * len(args.distances) if len(args.sound_speeds) == 1 else args.sound_speeds
+    if len(args.distances) != len(args.recordings) - 1 or len(sound_speeds) != len(args.distances):
+        parser.error("give one distance and sound speed per segment, that is one fewer than recordings")
+
+    result = survey_recordings(args.recordings, args.distances, sound_speeds, args.phat, args.count)
+    if not result.success:
+        location = f" ({result.error_location[0]}, line {result.error_location[1]})" if result.error_location else ""
+        print(f"Survey failed: {result.reason_of_error}{location}")
+        return
+
+    for candidate in result.candidates:
+        print(f"{candidate.line_position:.1f} m from the first sensor, segment {candidate.segment + 1}, "
+              f"score {candidate.peak.sidelobe_ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import matplotlib
+from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2QT as NavigationToolbar
+from matplotlib.figure import Figure
+import numpy
+
+from envelope import min_max_envelope
+import telemetry
+
+matplotlib.use("Qt5Agg")
+
+class Canvas(FigureCanvas):
+    def __init__(self) -> None:
+        figure = Figure(figsize=(500, 500), facecolor="white")
+        self.axes = figure.add_subplot()
+        super().__init__(figure)
+
+        self.result_array = numpy.zeros(0)
+        self.background = None
+        self.line, = self.axes.plot([], [], animated=True)
+        self.mpl_connect("draw_event", self.blit_line)
+
+    def set_result(self, result_array):
+        self.result_array = numpy.asarray(result_array, dtype=numpy.float64)
+        limits = (self.axes.get_xlim(), self.axes.get_ylim())
+
+        if len(self.result_array):
+            low, high = float(self.result_array.min()), float(self.result_array.max())
+            margin = (high - low) * 0.05 or 1
+            self.axes.set_xlim(0, max(len(self.result_array) - 1, 1))
+            self.axes.set_ylim(low - margin, high + margin)
+
+        if self.background is not None and limits == (self.axes.get_xlim(), self.axes.get_ylim()):
+            self.refresh_line()
+        else:
+            self.draw_idle()
+
+    def clear_result(self):
+        self.result_array = numpy.zeros(0)
+        self.draw_idle()
+
+    def update_line(self):
+        start, stop = self.axes.get_xlim()
+        self.line.set_data(*min_max_envelope(self.result_array, start, stop, int(self.axes.bbox.width)))
+
+    def draw_line(self):
+        with telemetry.stage("plot", samples=len(self.result_array)):
+            self.update_line()
+            self.axes.draw_artist(self.line)
+            self.blit(self.axes.bbox)
+
+    def blit_line(self, event):
+        # Every full redraw (zoom, pan, resize) leaves a background without the
+        # curve; the curve is decimated for the new view and blitted on top.
+        self.background = self.copy_from_bbox(self.axes.bbox)
+        self.draw_line()
+
+    def refresh_line(self):
+        self.restore_region(self.background)
+        self.draw_line()
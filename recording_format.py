@@ -0,0 +1,61 @@
+from collections import namedtuple
+import struct
+
+import numpy
+
+MAGIC = b"LFRC"
+VERSION = 1
+HEADER = struct.Struct("<4sBcIQdd")
+HEADER_SIZE = HEADER.size
+
+DTYPES = {b"h": numpy.int16, b"H": numpy.uint16}
+DTYPE_CODES = {"int16": b"h", "uint16": b"H"}
+
+RecordingHeader = namedtuple("RecordingHeader", ["sample_rate", "count", "distance", "sound_speed", "dtype"])
+
+
+def pack_header(sample_rate, count, distance, sound_speed, dtype="int16"):
+    return HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], sample_rate, count, distance, sound_speed)
+
+
+def write_header(file, sample_rate, count, distance, sound_speed, dtype="int16"):
+    file.write(pack_header(sample_rate, count, distance, sound_speed, dtype))
+
+
+def write_recording(path, samples, sample_rate, distance, sound_speed, dtype="int16"):
+    samples = numpy.asarray(samples, dtype=numpy.dtype(dtype).newbyteorder("<"))
+    with open(path, "wb") as file:
+        write_header(file, sample_rate, len(samples), distance, sound_speed, dtype)
+        file.write(samples.tobytes())
+
+
+def is_binary_recording(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_header(path):
+    with open(path, "rb") as file:
+        data = file.read(HEADER_SIZE)
+
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"File '{path}' is too short to be a recording")
+
+    magic, version, dtype_code, sample_rate, count, distance, sound_speed = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(f"File '{path}' is not a binary recording")
+    if version != VERSION or dtype_code not in DTYPES:
+        raise ValueError(f"Unsupported recording format in '{path}'")
+
+    return RecordingHeader(sample_rate, count, distance, sound_speed, DTYPES[dtype_code])
+
+
+def open_recording(path, header=None):
+    if header is None:
+        header = read_header(path)
+
+    dtype = numpy.dtype(header.dtype).newbyteorder("<")
+    if header.count == 0:
+        return numpy.zeros(0, dtype=dtype)
+
+    return numpy.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(header.count,))
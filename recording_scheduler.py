@@ -0,0 +1,212 @@
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sys import stderr
+from traceback import format_exc
+
+DEFAULT_PATH = Path.home() / ".leak_finder" / "jobs.json"
+DAY = 24 * 60 * 60
+# The timer thread wakes at least this often, so a clock change or a laptop
+# resuming from sleep delays a due job by no more than this many seconds.
+MAX_WAIT = 60
+
+
+def next_start(hours, minutes, now=None):
+    now = now or datetime.datetime.now()
+    start = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    if start < now.replace(second=0, microsecond=0):
+        start += datetime.timedelta(days=1)
+    return start
+
+
+def job_start(job):
+    return datetime.datetime.fromisoformat(job["start"])
+
+
+def job_sensors(job):
+    # Jobs on the same sensors must not overlap; jobs without ports (the
+    # imitation) never conflict.
+    return tuple(job["params"].get("com_ports") or ())
+
+
+class RecordingScheduler:
+    def __init__(self, run_job, path=DEFAULT_PATH, max_workers=2, on_change=None, on_finish=None):
+        self.run_job = run_job
+        self.path = Path(path)
+        self.on_change = on_change
+        self.on_finish = on_finish
+
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recording")
+        self.timer = threading.Thread(target=self.run, name="recording-scheduler", daemon=True)
+        self.busy_sensors = set()
+        self.stopped = False
+        # Set on exit; a running recording checks it and stops early.
+        self.interrupt = threading.Event()
+
+        self.job_list = self.load()
+        self.next_id = max((job["id"] for job in self.job_list), default=0) + 1
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                jobs = json.load(file)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError):
+            print(format_exc(1), file=stderr)
+            return []
+
+        now = datetime.datetime.now()
+        for job in jobs:
+            if job["status"] == "running":
+                # The program was closed in the middle of this recording.
+                self.finish(job, "failed", 0, now, "interrupted")
+        return jobs
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(self.job_list, file, ensure_ascii=False, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def notify(self, job):
+        if self.on_change is not None:
+            self.on_change(job)
+
+    def add(self, start, params, interval=None):
+        with self.condition:
+            job = {"id": self.next_id, "start": start.isoformat(), "interval": interval, "params": params,
+                   "status": "pending", "last_result": None, "reason": None, "runs": 0}
+            self.next_id += 1
+            self.job_list.append(job)
+            self.save()
+            self.condition.notify()
+            snapshot = dict(job)
+
+        self.notify(snapshot)
+        return snapshot["id"]
+
+    def cancel(self, job_id):
+        with self.condition:
+            job = next((job for job in self.job_list if job["id"] == job_id), None)
+            if job is None or job["status"] not in ("pending", "running"):
+                return False
+
+            # A recording that has already started runs to the end, but it
+            # will not come back.
+            job["interval"] = None
+            if job["status"] == "pending":
+                job["status"] = "cancelled"
+            self.save()
+            self.condition.notify()
+            snapshot = dict(job)
+
+        self.notify(snapshot)
+        return True
+
+    def remove_finished(self):
+        with self.condition:
+            self.job_list = [job for job in self.job_list if job["status"] in ("pending", "running")]
+            self.save()
+
+    def jobs(self):
+        with self.condition:
+            return [dict(job) for job in self.job_list]
+
+    def finish(self, job, status, result, now, reason=None):
+        job["last_result"] = result
+        job["reason"] = reason
+        job["runs"] += 1
+        if job["interval"]:
+            start = job_start(job)
+            while start <= now:
+                start += datetime.timedelta(seconds=job["interval"])
+            job["start"] = start.isoformat()
+            job["status"] = "pending"
+        else:
+            job["status"] = status
+
+    def execute(self, job):
+        try:
+            result = self.run_job(dict(job), self.interrupt)
+        except Exception:
+            print(format_exc(10), file=stderr)
+            result = 0
+
+        reason = None
+        if self.interrupt.is_set():
+            result, reason = 0, "interrupted"
+
+        with self.condition:
+            self.busy_sensors.difference_update(job_sensors(job))
+            self.finish(job, "done" if result else "failed", result, datetime.datetime.now(), reason)
+            self.save()
+            self.condition.notify()
+            snapshot = dict(job)
+
+        self.notify(snapshot)
+        if self.on_finish is not None and reason is None:
+            self.on_finish(snapshot)
+
+    def launch(self, job):
+        job["status"] = "running"
+        self.busy_sensors.update(job_sensors(job))
+        self.save()
+        self.executor.submit(self.execute, job)
+
+    def run(self):
+        with self.condition:
+            while not self.stopped:
+                now = datetime.datetime.now()
+                launched = []
+                for job in self.job_list:
+                    if job["status"] != "pending" or job_start(job) > now or self.busy_sensors.intersection(job_sensors(job)):
+                        continue
+                    self.launch(job)
+                    launched.append(dict(job))
+
+                if launched:
+                    self.condition.release()
+                    try:
+                        for job in launched:
+                            self.notify(job)
+                    finally:
+                        self.condition.acquire()
+                    continue
+
+                # Due jobs waiting for busy sensors are woken by execute().
+                waits = [(job_start(job) - now).total_seconds() for job in self.job_list
+                         if job["status"] == "pending" and job_start(job) > now]
+                self.condition.wait(min([MAX_WAIT] + waits))
+
+    def start(self):
+        self.timer.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.timer.join(timeout=1)
+
+        # Queued jobs are dropped first, so none of them starts in a freed
+        # worker; running recordings are then told to stop and awaited, so
+        # their files are closed and their jobs saved before the program
+        # exits.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.interrupt.set()
+        self.executor.shutdown(wait=True)
+
+        # Jobs still queued for a worker never started recording, so they
+        # wait for the next start instead of being marked interrupted.
+        with self.condition:
+            queued = [job for job in self.job_list if job["status"] == "running"]
+            for job in queued:
+                job["status"] = "pending"
+            if queued:
+                self.save()
@@ -0,0 +1,121 @@
+import os
+
+import numpy
+
+from compressed_recording import CompressedWriter
+from recording_format import write_header
+import telemetry
+
+FILE_FORMATS = ("txt", "bin", "lfz")
+FSYNC_POLICIES = ("never", "close", "flush")
+
+
+def format_text(samples):
+    # Builds every line right-aligned in a fixed-width byte matrix and keeps
+    # only the bytes each number needs, instead of calling str() per sample.
+    values = numpy.asarray(samples, dtype=numpy.int64)
+    if len(values) == 0:
+        return b""
+
+    magnitude = numpy.abs(values)
+    digits = len(str(int(magnitude.max())))
+    widths = numpy.ones(len(values), dtype=numpy.int64)
+    power = 10
+    for _ in range(digits - 1):
+        widths += magnitude >= power
+        power *= 10
+
+    row = digits + 2
+    matrix = numpy.empty((len(values), row), dtype=numpy.uint8)
+    matrix[:, -1] = ord("\n")
+    for column in range(row - 2, 0, -1):
+        matrix[:, column] = ord("0") + magnitude % 10
+        magnitude //= 10
+
+    negative = values < 0
+    negative_rows = numpy.flatnonzero(negative)
+    matrix[negative_rows, row - 2 - widths[negative_rows]] = ord("-")
+
+    mask = numpy.arange(row) >= row - 1 - widths[:, None] - negative[:, None]
+    return matrix[mask].tobytes()
+
+
+class RecordingWriter:
+    def __init__(self, path, file_format="txt", sample_rate=9600, count=0, distance=0, sound_speed=0,
+                 buffer_samples=1 << 16, fsync="never"):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format '{file_format}', expected one of {', '.join(FILE_FORMATS)}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', expected one of {', '.join(FSYNC_POLICIES)}")
+
+        self.path = str(path)
+        self.file_format = file_format
+        self.sample_rate = sample_rate
+        self.distance = distance
+        self.sound_speed = sound_speed
+        self.buffer_samples = buffer_samples
+        self.fsync = fsync
+
+        self.pending = []
+        self.pending_count = 0
+        self.count = 0
+
+        self.file = open(path, "wb")
+        self.output = self.file
+        if file_format == "bin":
+            write_header(self.file, sample_rate, count, distance, sound_speed)
+        elif file_format == "lfz":
+            self.output = CompressedWriter(self.file, sample_rate, distance, sound_speed, chunk_samples=buffer_samples)
+
+    def write(self, samples):
+        self.pending.append(numpy.asarray(samples))
+        self.pending_count += len(samples)
+        if self.pending_count >= self.buffer_samples:
+            self.flush()
+
+    def encode(self, samples):
+        if self.file_format == "bin":
+            return samples.astype("<i2").tobytes()
+        if self.file_format == "lfz":
+            return samples
+        return format_text(samples)
+
+    def flush(self):
+        if self.pending:
+            samples = numpy.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+            with telemetry.stage("file_write", path=self.path, samples=len(samples)) as record:
+                record["bytes"] = self.output.write(self.encode(samples))
+            self.count += len(samples)
+            self.pending = []
+            self.pending_count = 0
+
+        self.file.flush()
+        if self.fsync == "flush":
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        try:
+            self.flush()
+            if self.file_format == "lfz":
+                self.output.close()
+            elif self.file_format == "bin":
+                # The header promised the expected length; a recording cut
+                # short must not claim samples it does not have.
+                self.file.seek(0)
+                write_header(self.file, self.sample_rate, self.count, self.distance, self.sound_speed)
+                self.file.seek(0, os.SEEK_END)
+
+            self.file.flush()
+            if self.fsync != "never":
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,89 @@
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+
+import numpy
+
+from correlation import CORRELATION_VERSION, Peak
+
+DEFAULT_DIRECTORY = Path.home() / ".leak_finder" / "cache"
+DEFAULT_SIZE_LIMIT = 512 * 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=None, size_limit=DEFAULT_SIZE_LIMIT):
+        self.directory = Path(directory or os.environ.get("LEAK_FINDER_CACHE", DEFAULT_DIRECTORY))
+        self.size_limit = size_limit
+
+    def key(self, file_names, distance, sound_speed, mode, engine_name):
+        parts = [file_digest(name) for name in file_names]
+        parts += [repr(float(distance)), repr(float(sound_speed)), mode, engine_name, str(CORRELATION_VERSION)]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with numpy.load(path) as data:
+                result_array = data["result_array"]
+                peaks, distances = data["peaks"], data["distances"]
+            # The modification time doubles as the last-use time for eviction.
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        candidates = tuple((Peak(int(peak[0]), *map(float, peak[1:])), tuple(map(float, result_distances)))
+                           for peak, result_distances in zip(peaks, distances))
+        return result_array, candidates
+
+    def put(self, key, result_array, candidates):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        peaks = numpy.array([list(peak) for peak, result_distances in candidates], dtype=numpy.float64).reshape(-1, 4)
+        distances = numpy.array([result_distances for peak, result_distances in candidates], dtype=numpy.float64).reshape(-1, 3)
+
+        # Another thread or process may be storing the same key, so every
+        # writer gets a temporary file of its own.
+        temporary_path = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, prefix=f"{key}.", suffix=".tmp", delete=False) as file:
+                temporary_path = Path(file.name)
+                numpy.savez(file, result_array=result_array, peaks=peaks, distances=distances)
+            os.replace(temporary_path, self.path(key))
+        except OSError:
+            if temporary_path is not None:
+                temporary_path.unlink(missing_ok=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for modified, size, path in entries)
+        for modified, size, path in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+    def clear(self):
+        for pattern in ("*.npz", "*.tmp"):
+            for path in self.directory.glob(pattern):
+                path.unlink(missing_ok=True)
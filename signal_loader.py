@@ -0,0 +1,92 @@
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from recording_format import is_binary_recording, open_recording
+from compressed_recording import is_compressed_recording, read_compressed_recording
+import telemetry
+
+
+def parse_lines(lines):
+    return numpy.array(lines, dtype=bytes).astype(numpy.float64)
+
+
+def find_bad_line(lines):
+    low, high = 0, len(lines)
+    while high - low > 1:
+        middle = (low + high) // 2
+        try:
+            parse_lines(lines[low:middle])
+            low = middle
+        except ValueError:
+            high = middle
+
+    return low + 1
+
+
+def line_chunks(data, chunk_bytes):
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start + chunk_bytes - 1) + 1 or len(data)
+        lines = data[start:end].split(b"\n")
+        if lines[-1] == b"":
+            lines.pop()
+        yield end, lines
+        start = end
+
+
+def fits_int16(values):
+    return bool(numpy.all((values >= -32768) & (values <= 32767) & (values == numpy.rint(values))))
+
+
+def load_text_recording(path, on_progress=None, chunk_bytes=1 << 20):
+    with telemetry.stage("file_read", path=str(path)) as record, open(path, "rb") as file:
+        data = file.read()
+        record["bytes"] = len(data)
+
+    # Sensor readings are small integers, so they are kept as int16 and only
+    # about a megabyte of lines is split at a time; a recording holding
+    # anything else falls back to float32.
+    count = data.count(b"\n")
+    if data and not data.endswith(b"\n"):
+        count += 1
+    samples = numpy.empty(count, dtype=numpy.int16)
+    line_number = 0
+    with telemetry.stage("parse", path=str(path), samples=count):
+        for end, lines in line_chunks(data, chunk_bytes):
+            try:
+                values = parse_lines(lines)
+            except ValueError:
+                return None, line_number + find_bad_line(lines)
+
+            if samples.dtype == numpy.int16 and not fits_int16(values):
+                samples = samples.astype(numpy.float32)
+            samples[line_number:line_number + len(lines)] = values
+            line_number += len(lines)
+
+            if on_progress is not None:
+                on_progress(end / len(data))
+
+    return samples, None
+
+
+def load_text_recordings(paths, on_progress=None):
+    fractions = [0] * len(paths)
+
+    def load(index):
+        def report(fraction):
+            fractions[index] = fraction
+            on_progress(sum(fractions) / len(paths))
+
+        return load_text_recording(paths[index], report if on_progress is not None else None)
+
+    with ThreadPool(processes=len(paths)) as pool:
+        return pool.map(load, range(len(paths)))
+
+
+def load_recording(path, on_progress=None):
+    if is_binary_recording(path):
+        return open_recording(path), None
+    if is_compressed_recording(path):
+        return read_compressed_recording(path, on_progress), None
+    return load_text_recording(path, on_progress)
@@ -0,0 +1,56 @@
+import numpy
+
+from correlation import block_length, correlate_block, calculate_distances
+
+
+class StreamingCorrelator:
+    def __init__(self, distance, sound_speed, block_size=None, on_update=None):
+        self.distance = distance
+        self.sound_speed = sound_speed
+        self.on_update = on_update
+
+        self.lags = block_length(distance, sound_speed)
+        if self.lags <= 0:
+            raise ValueError("The distance between the sensors is too short for the sample rate")
+        self.block_size = block_size or self.lags
+        if self.block_size <= 0:
+            raise ValueError("The block size must be positive")
+
+        self.result = numpy.zeros(self.lags)
+        self.samples_count = 0
+
+        # The last `lags` samples of the second channel, so that every block of
+        # the first channel can be matched against the lags reaching back
+        # before it (overlap-save). Samples before the start count as zeros.
+        self.history = numpy.zeros(self.lags)
+        self.pending_1 = numpy.zeros(0)
+        self.pending_2 = numpy.zeros(0)
+
+    def add_samples(self, samples_1, samples_2):
+        self.pending_1 = numpy.concatenate((self.pending_1, numpy.asarray(samples_1, dtype=numpy.float64)))
+        self.pending_2 = numpy.concatenate((self.pending_2, numpy.asarray(samples_2, dtype=numpy.float64)))
+
+        while min(len(self.pending_1), len(self.pending_2)) >= self.block_size:
+            self.process_block(self.block_size)
+
+    def flush(self):
+        length = min(len(self.pending_1), len(self.pending_2))
+        if length:
+            self.process_block(length)
+
+    def process_block(self, length):
+        block_1 = self.pending_1[:length]
+        signal = numpy.concatenate((self.history, self.pending_2[:length]))
+
+        self.result += correlate_block(block_1, signal, self.lags)
+        self.history = signal[len(signal) - self.lags:]
+        self.samples_count += length
+
+        self.pending_1 = self.pending_1[length:]
+        self.pending_2 = self.pending_2[length:]
+
+        if self.on_update is not None:
+            self.on_update(self.distances())
+
+    def distances(self):
+        return calculate_distances(self.result, self.distance, self.sound_speed)
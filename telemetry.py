@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Stage timings are written as JSON lines to the file named by
+# LEAK_FINDER_TELEMETRY ("-" for stderr). When it is unset every hook returns
+# straight away, so instrumented code costs one attribute check per stage.
+sink = None
+track_memory = False
+lock = threading.Lock()
+open_peaks = {}
+
+
+def configure(path=None, memory=None):
+    global sink, track_memory
+    if memory is None:
+        memory = os.environ.get("LEAK_FINDER_TELEMETRY_MEMORY")
+    if sink is not None and sink is not sys.stderr:
+        sink.close()
+
+    if not path:
+        sink = None
+    elif path == "-":
+        sink = sys.stderr
+    else:
+        sink = open(path, "a", buffering=1)
+
+    track_memory = bool(memory) and sink is not None
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def active():
+    return sink is not None
+
+
+def emit(stage_name, seconds, fields):
+    entry = {"stage": stage_name, "seconds": seconds, "time": time.time(), "process": os.getpid(),
+             "thread": threading.current_thread().name}
+    entry.update(fields)
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with lock:
+        if sink is not None:
+            sink.write(line + "\n")
+
+
+def record(stage_name, started, **fields):
+    if sink is not None:
+        emit(stage_name, time.perf_counter() - started, fields)
+
+
+def update_peaks():
+    # tracemalloc keeps a single process-wide peak, so every stage that is
+    # open when it is reset takes its share before it is lost.
+    current_peak = tracemalloc.get_traced_memory()[1]
+    for peak in open_peaks.values():
+        peak[0] = max(peak[0], current_peak)
+
+
+@contextmanager
+def measured(stage_name, fields):
+    peak = [0]
+    if track_memory:
+        with lock:
+            update_peaks()
+            tracemalloc.reset_peak()
+            open_peaks[id(peak)] = peak
+
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        seconds = time.perf_counter() - started
+        if track_memory:
+            with lock:
+                update_peaks()
+                del open_peaks[id(peak)]
+            fields["peak_memory_bytes"] = peak[0]
+        emit(stage_name, seconds, fields)
+
+
+def stage(stage_name, **fields):
+    if sink is None:
+        return nullcontext({})
+    return measured(stage_name, fields)
+
+
+configure(os.environ.get("LEAK_FINDER_TELEMETRY"))